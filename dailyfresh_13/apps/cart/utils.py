@@ -0,0 +1,151 @@
+from django_redis import get_redis_connection
+
+# 购物车操作使用的lua脚本，在redis中原子执行，每个操作只需要一次网络往返
+# KEYS[1] 购物车哈希 "cart_用户id"， KEYS[2] 购物车总数 "cart_num_用户id"
+
+# 获取购物车总数，总数不存在时（以前保存的购物车）根据购物车数据计算
+GET_TOTAL = """
+local function get_total()
+    local total = redis.call("GET", KEYS[2])
+    if total then
+        return tonumber(total)
+    end
+    total = 0
+    local counts = redis.call("HVALS", KEYS[1])
+    for i = 1, #counts do
+        total = total + tonumber(counts[i])
+    end
+    return total
+end
+"""
+
+# 重新计算购物车总数
+REBUILD_TOTAL = GET_TOTAL + """
+local total = get_total()
+redis.call("SET", KEYS[2], total)
+return total
+"""
+
+# 商品数量累加 ARGV: sku_id, count
+ADD = GET_TOTAL + """
+local total = get_total() + tonumber(ARGV[2])
+redis.call("HINCRBY", KEYS[1], ARGV[1], ARGV[2])
+redis.call("SET", KEYS[2], total)
+return total
+"""
+
+# 设置商品数量，数量不超过上限 ARGV: sku_id, count, 上限(小于0表示没有上限)
+SET_WITH_CAP = GET_TOTAL + """
+local count = tonumber(ARGV[2])
+local cap = tonumber(ARGV[3])
+if cap >= 0 and count > cap then
+    count = cap
+end
+local origin_count = tonumber(redis.call("HGET", KEYS[1], ARGV[1]) or 0)
+local total = get_total() - origin_count + count
+redis.call("HSET", KEYS[1], ARGV[1], count)
+redis.call("SET", KEYS[2], total)
+return {count, total}
+"""
+
+# 删除商品 ARGV: sku_id, sku_id, ...
+DELETE = GET_TOTAL + """
+local total = get_total()
+for i = 1, #ARGV do
+    local count = redis.call("HGET", KEYS[1], ARGV[i])
+    if count then
+        total = total - tonumber(count)
+        redis.call("HDEL", KEYS[1], ARGV[i])
+    end
+end
+redis.call("SET", KEYS[2], total)
+return total
+"""
+
+# 取出要下单的商品，有商品不在购物车中时不修改购物车 ARGV: sku_id, sku_id, ...  返回每个商品的数量，失败时返回nil
+TAKE = GET_TOTAL + """
+local total = get_total()
+local counts = {}
+for i = 1, #ARGV do
+    local count = redis.call("HGET", KEYS[1], ARGV[i])
+    if not count then
+        return false
+    end
+    counts[i] = count
+    total = total - tonumber(count)
+end
+redis.call("HDEL", KEYS[1], unpack(ARGV))
+redis.call("SET", KEYS[2], total)
+return counts
+"""
+
+# 合并cookie中的购物车，数量求和 ARGV: sku_id, count, sku_id, count, ...
+MERGE = GET_TOTAL + """
+local total = get_total()
+for i = 1, #ARGV, 2 do
+    redis.call("HINCRBY", KEYS[1], ARGV[i], ARGV[i + 1])
+    total = total + tonumber(ARGV[i + 1])
+end
+redis.call("SET", KEYS[2], total)
+return total
+"""
+
+
+class RedisCart(object):
+    """登录用户保存在redis中的购物车
+
+    购物车数据保存在哈希 "cart_用户id" 中 {"sku_1": "10", "sku_2": "11"}，
+    同时在 "cart_num_用户id" 中保存购物车商品的总数，修改购物车时一起更新，统计总数时不用再取出整个购物车
+    """
+    # 注册到redis的脚本对象 {脚本: Script}，第一次使用时注册，执行时使用EVALSHA
+    _scripts = {}
+
+    def __init__(self, user_id, redis_conn=None):
+        self.redis_conn = redis_conn or get_redis_connection("default")
+        self.cart_key = "cart_%s" % user_id
+        self.total_key = "cart_num_%s" % user_id
+
+    def _run(self, script, *args):
+        """执行购物车的lua脚本"""
+        if script not in self._scripts:
+            self._scripts[script] = self.redis_conn.register_script(script)
+        return self._scripts[script](keys=[self.cart_key, self.total_key], args=args, client=self.redis_conn)
+
+    def items(self):
+        """返回购物车的字典数据 {b"sku_id": b"count"}"""
+        return self.redis_conn.hgetall(self.cart_key)
+
+    def total(self):
+        """返回购物车中商品的总数"""
+        total = self.redis_conn.get(self.total_key)
+        if total is not None:
+            return int(total)
+        return self._run(REBUILD_TOTAL)
+
+    def add(self, sku_id, count):
+        """商品数量累加，返回购物车最新的总数"""
+        return self._run(ADD, sku_id, count)
+
+    def set(self, sku_id, count, cap=-1):
+        """设置商品的数量，数量不超过cap，返回(保存的数量, 购物车最新的总数)"""
+        count, total = self._run(SET_WITH_CAP, sku_id, count, cap)
+        return count, total
+
+    def delete(self, *sku_ids):
+        """删除商品，返回购物车最新的总数"""
+        return self._run(DELETE, *sku_ids)
+
+    def take(self, *sku_ids):
+        """原子地从购物车中取出商品，返回 {sku_id: count}，有商品不在购物车中时返回None，购物车不变"""
+        sku_ids = list(set(int(sku_id) for sku_id in sku_ids))
+        counts = self._run(TAKE, *sku_ids)
+        if counts is None:
+            return None
+        return {sku_id: int(count) for sku_id, count in zip(sku_ids, counts)}
+
+    def merge(self, cart):
+        """将cookie中的购物车 {"sku_id": count} 合并到redis中，相同商品数量求和，返回购物车最新的总数"""
+        args = []
+        for sku_id, count in cart.items():
+            args.extend([sku_id, count])
+        return self._run(MERGE, *args)
@@ -2,7 +2,8 @@ from django.shortcuts import render
 from django.views.generic import View
 from django.http import JsonResponse
 from goods.models import GoodsSKU
-from django_redis import get_redis_connection
+from goods.utils import get_skus
+from cart.utils import RedisCart
 import json
 
 # Create your views here.
@@ -51,25 +52,10 @@ class AddCartView(View):
             user_id = request.user.id
             # 如果用户登录，将数据保存到redis中
             # "cart_user_id": {"sku_1": 10, "sku_2": 20}
-            redis_conn = get_redis_connection("default")
-
-            # 先从redis中尝试获取用户原有购物车中相同商品的信息
-            user_id = request.user.id
-            origin_count = redis_conn.hget("cart_%s" % user_id, sku_id)
-
             # 如果redis中不存在，则直接将数据保存到redis的购物车中
             # 如果redis中原本包含了这个商品的数量信息， 进行数量累加，在保存到redis中
-            if origin_count is not None:
-                count += int(origin_count)
-
-            redis_conn.hset("cart_%s" % user_id, sku_id, count)
-
-            # 计算购物车中最新的总数
-            cart_num = 0
-            cart = redis_conn.hgetall("cart_%s" % user_id)
-            # {"sku_id": "10", "sku_id": "11"}
-            for val in cart.values():
-                cart_num += int(val)
+            # 同时返回购物车中最新的总数
+            cart_num = RedisCart(user_id).add(sku_id, count)
             # 通过返回json数据，告知前端处理的结果
             return JsonResponse({"code": 0, "message": "添加购物车成功", "cart_num": cart_num})
         else:
@@ -122,26 +108,21 @@ class CartInfoView(View):
                 cart = {}
         else:
             # 如果用户已登录，从redis中读取购物车数据
-            redis_conn = get_redis_connection("default")
-            user_id = request.user.id
-            cart = redis_conn.hgetall("cart_%s" % user_id)
+            cart = RedisCart(request.user.id).items()
+
+        # 从mysql数据（或缓存）中一次性查询购物车中的商品信息, 不存在的商品不显示
+        # {sku_id: count}
+        cart = {int(sku_id): int(count) for sku_id, count in cart.items()}
+        skus, _ = get_skus(cart.keys(), use_cache=True)
 
-        # 遍历cart字典购物车，从mysql数据中查询商品信息
-        skus = []
         total_count = 0  # 商品总数
         total_amount = 0  # 商品总金额
-        for sku_id, count in cart.items():
-            try:
-                sku = GoodsSKU.objects.get(id=sku_id)
-            except GoodsSKU.DoesNotExist:
-                # 商品不存在
-                continue
+        for sku in skus:
             # 计算商品的金额
-            count = int(count)
+            count = cart[sku.id]
             amount = sku.price * count    # price字段是DecimalField, 在python中是Decimal数据类型
             sku.amount = amount
             sku.count = count
-            skus.append(sku)
 
             total_count += count
             total_amount += amount
@@ -195,16 +176,10 @@ class UpdateCartView(View):
             response.set_cookie("cart", json.dumps(cart))
             return response
         else:
-            # 如果用户已登录，保存数据到redis中
-            redis_conn = get_redis_connection("default")
-            user_id = request.user.id
-            # cart = redis_conn.hgetall("cart_%s" % user_id)
-            # # 将sku_id转换为bytes，对redis返回的字典cart进行操作
-            # sku_id = sku_id.encode()
-            # cart[sku_id] = count
-            redis_conn.hset("cart_%s" % user_id, sku_id, count)
+            # 如果用户已登录，保存数据到redis中, 数量不超过库存
+            count, cart_num = RedisCart(request.user.id).set(sku_id, count, cap=sku.stock)
             # 返回结果， 返回Json数据
-            return JsonResponse({"code": 0, "message": "修改成功"})
+            return JsonResponse({"code": 0, "message": "修改成功", "count": count, "cart_num": cart_num})
 
 
 class DeleteCartView(View):
@@ -235,10 +210,8 @@ class DeleteCartView(View):
                 return JsonResponse({"code": 0, "message": "删除成功"})
         else:
             # 用户已登录，操作redis
-            redis_conn = get_redis_connection("default")
-            user_id = request.user.id
             # 删除redis中的sku_id字段的记录
-            redis_conn.hdel("cart_%s" % user_id, sku_id)
+            RedisCart(request.user.id).delete(sku_id)
             return JsonResponse({"code": 0, "message": "删除成功"})
 
 
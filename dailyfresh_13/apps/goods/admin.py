@@ -4,7 +4,6 @@ from django.contrib import admin
 from goods.models import GoodsCategory, Goods, GoodsSKU, GoodsImage
 from goods.models import IndexGoodsBanner, IndexCategoryGoodsBanner, IndexPromotionBanner
 from celery_tasks.tasks import generate_static_index_html
-from django.core.cache import cache
 
 
 class BaseAdmin(admin.ModelAdmin):
@@ -16,22 +15,18 @@ class BaseAdmin(admin.ModelAdmin):
         obj.save()
 
         # 调用生成静态页面的celery异步任务
+        # 主页的缓存数据由goods.signals中的信号处理函数按照标签失效
         generate_static_index_html.delay()
 
-        # 清除主页的缓存数据
-        cache.delete("index_page_data")
-
     def delete_model(self, request, obj):
         """admin站点在模型删除数据的时候调用"""
         # 从数据库中删除
         obj.delete()
 
         # 调用生成静态页面的celery异步任务
+        # 主页的缓存数据由goods.signals中的信号处理函数按照标签失效
         generate_static_index_html.delay()
 
-        # 清除主页的缓存数据
-        cache.delete("index_page_data")
-
 
 class GoodsCategoryAdmin(BaseAdmin):
     """商品分类信息的管理类"""
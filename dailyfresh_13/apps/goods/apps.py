@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class GoodsConfig(AppConfig):
+    name = "goods"
+    verbose_name = "商品"
+
+    def ready(self):
+        # 注册模型的信号处理函数
+        from goods import signals
@@ -0,0 +1,195 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+from goods.models import GoodsSKU
+
+# 抢购模式下，商品库存保存在redis的计数器中，下单时在redis中原子扣减库存（预占），
+# 预占的数量记录在 STOCK_PENDING_KEY 中，由celery任务批量同步到mysql的库存和销量中
+
+# 商品库存计数器
+STOCK_KEY = "stock_%s"
+# 还没有同步到mysql的预占数量 {sku_id: count}
+STOCK_PENDING_KEY = "stock_pending"
+# 正在同步到mysql的预占数量
+STOCK_SYNCING_KEY = "stock_pending_syncing"
+
+# 预占库存 KEYS: 库存计数器..., STOCK_PENDING_KEY  ARGV: 数量..., sku_id...
+# 返回0表示成功，返回 i 表示第i个商品库存不足，返回 -i 表示第i个商品的库存计数器不存在
+RESERVE = """
+local n = #KEYS - 1
+for i = 1, n do
+    local stock = redis.call("GET", KEYS[i])
+    if not stock then
+        return -i
+    end
+    if tonumber(stock) < tonumber(ARGV[i]) then
+        return i
+    end
+end
+for i = 1, n do
+    redis.call("DECRBY", KEYS[i], ARGV[i])
+    redis.call("HINCRBY", KEYS[n + 1], ARGV[n + i], ARGV[i])
+end
+return 0
+"""
+
+# 释放预占的库存 KEYS、ARGV 同RESERVE
+RELEASE = """
+local n = #KEYS - 1
+for i = 1, n do
+    redis.call("INCRBY", KEYS[i], ARGV[i])
+    redis.call("HINCRBY", KEYS[n + 1], ARGV[n + i], -tonumber(ARGV[i]))
+end
+return 0
+"""
+
+# 后台修改库存之后调整计数器，计数器不存在时不创建（下次预占时从mysql初始化） KEYS: 库存计数器...  ARGV: 变化量...
+ADJUST = """
+for i = 1, #KEYS do
+    if redis.call("EXISTS", KEYS[i]) == 1 then
+        redis.call("INCRBY", KEYS[i], ARGV[i])
+    end
+end
+return 0
+"""
+
+_scripts = {}
+
+
+def is_enabled():
+    """是否开启了redis预占库存的模式"""
+    return getattr(settings, "INVENTORY_RESERVATION", False)
+
+
+def _run(redis_conn, script, counts):
+    if script not in _scripts:
+        _scripts[script] = redis_conn.register_script(script)
+    sku_ids = list(counts.keys())
+    keys = [STOCK_KEY % sku_id for sku_id in sku_ids] + [STOCK_PENDING_KEY]
+    args = [counts[sku_id] for sku_id in sku_ids] + sku_ids
+    return sku_ids, _scripts[script](keys=keys, args=args, client=redis_conn)
+
+
+def _pending_counts(redis_conn, sku_ids):
+    """还没有同步到mysql的预占数量 {sku_id: count}"""
+    pipe = redis_conn.pipeline()
+    pipe.hmget(STOCK_PENDING_KEY, sku_ids)
+    pipe.hmget(STOCK_SYNCING_KEY, sku_ids)
+    pending, syncing = pipe.execute()
+    return {sku_id: int(pending[i] or 0) + int(syncing[i] or 0) for i, sku_id in enumerate(sku_ids)}
+
+
+def get_expected_stock(sku_ids, redis_conn=None):
+    """根据mysql中的库存和还没有同步的预占数量， 计算redis中应该有的库存 {sku_id: stock}"""
+    redis_conn = redis_conn or get_redis_connection("default")
+    sku_ids = list(sku_ids)
+    db_stock = dict(GoodsSKU.objects.using("default").filter(id__in=sku_ids).values_list("id", "stock"))
+    pending = _pending_counts(redis_conn, list(db_stock.keys()))
+    return {sku_id: stock - pending[sku_id] for sku_id, stock in db_stock.items()}
+
+
+def rebuild(sku_ids=None, redis_conn=None):
+    """根据mysql中的数据重建redis中的库存计数器，sku_ids为None时重建所有商品
+
+    直接覆盖计数器，读取mysql之后到写入redis之间的预占会丢失，只在维护命令中使用
+    """
+    redis_conn = redis_conn or get_redis_connection("default")
+    if sku_ids is None:
+        sku_ids = GoodsSKU.objects.using("default").values_list("id", flat=True)
+    expected = get_expected_stock(sku_ids, redis_conn)
+    if expected:
+        redis_conn.mset({STOCK_KEY % sku_id: stock for sku_id, stock in expected.items()})
+    return expected
+
+
+def init_missing(sku_ids, redis_conn=None):
+    """根据mysql中的数据初始化不存在的库存计数器，已经存在的计数器不修改（SETNX），不会覆盖并发的预占"""
+    redis_conn = redis_conn or get_redis_connection("default")
+    expected = get_expected_stock(sku_ids, redis_conn)
+    pipe = redis_conn.pipeline()
+    for sku_id, stock in expected.items():
+        pipe.setnx(STOCK_KEY % sku_id, stock)
+    pipe.execute()
+    return expected
+
+
+def adjust(deltas, redis_conn=None):
+    """后台修改了库存，按照修改的数量原子地调整库存计数器 deltas: {sku_id: 变化量}"""
+    deltas = {sku_id: delta for sku_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    redis_conn = redis_conn or get_redis_connection("default")
+    if ADJUST not in _scripts:
+        _scripts[ADJUST] = redis_conn.register_script(ADJUST)
+    sku_ids = list(deltas.keys())
+    _scripts[ADJUST](keys=[STOCK_KEY % sku_id for sku_id in sku_ids], args=[deltas[sku_id] for sku_id in sku_ids],
+                     client=redis_conn)
+
+
+def check_drift(sku_ids=None, redis_conn=None):
+    """检查redis中的库存与mysql是否一致，返回不一致的商品 [(sku_id, redis中的库存, 应该有的库存)]"""
+    redis_conn = redis_conn or get_redis_connection("default")
+    if sku_ids is None:
+        sku_ids = GoodsSKU.objects.using("default").values_list("id", flat=True)
+    expected = get_expected_stock(sku_ids, redis_conn)
+    sku_ids = list(expected.keys())
+    actual = redis_conn.mget([STOCK_KEY % sku_id for sku_id in sku_ids])
+    drift = []
+    for sku_id, stock in zip(sku_ids, actual):
+        stock = int(stock) if stock is not None else None
+        if stock != expected[sku_id]:
+            drift.append((sku_id, stock, expected[sku_id]))
+    return drift
+
+
+def reserve(counts, redis_conn=None):
+    """在redis中原子地预占多个商品的库存
+
+    :param counts: {sku_id: count}
+    :return: 库存不足的商品id，全部预占成功时返回None
+    """
+    redis_conn = redis_conn or get_redis_connection("default")
+    sku_ids, result = _run(redis_conn, RESERVE, counts)
+    if result < 0:
+        # 库存计数器不存在（第一次使用或被清除了），从mysql初始化之后再试一次
+        init_missing(sku_ids, redis_conn)
+        sku_ids, result = _run(redis_conn, RESERVE, counts)
+    if result != 0:
+        return sku_ids[abs(result) - 1]
+    return None
+
+
+def release(counts, redis_conn=None):
+    """订单保存失败，释放预占的库存 counts: {sku_id: count}"""
+    redis_conn = redis_conn or get_redis_connection("default")
+    _run(redis_conn, RELEASE, counts)
+
+
+def reconcile(batch_size=None, redis_conn=None):
+    """将预占的数量批量同步到mysql的库存和销量中，返回同步的商品数目"""
+    redis_conn = redis_conn or get_redis_connection("default")
+    batch_size = batch_size or settings.INVENTORY_RECONCILE_BATCH
+
+    # 上次同步失败时遗留的数据先同步，否则将待同步的数据原子地转移出来，之后的预占记录到新的哈希中
+    if not redis_conn.exists(STOCK_SYNCING_KEY):
+        try:
+            redis_conn.rename(STOCK_PENDING_KEY, STOCK_SYNCING_KEY)
+        except ResponseError:
+            # 没有需要同步的数据
+            return 0
+
+    pending = [(int(sku_id), int(count)) for sku_id, count in redis_conn.hgetall(STOCK_SYNCING_KEY).items()
+               if int(count) != 0]
+    # 按照id排序，与下单时锁定数据行的顺序相同
+    pending.sort()
+    for i in range(0, len(pending), batch_size):
+        with transaction.atomic():
+            for sku_id, count in pending[i:i + batch_size]:
+                GoodsSKU.objects.filter(id=sku_id).update(stock=F("stock") - count, sales=F("sales") + count)
+        # 已经同步的商品从哈希中删除，中途失败时下次只会同步剩下的商品
+        redis_conn.hdel(STOCK_SYNCING_KEY, *[sku_id for sku_id, _ in pending[i:i + batch_size]])
+
+    redis_conn.delete(STOCK_SYNCING_KEY)
+    return len(pending)
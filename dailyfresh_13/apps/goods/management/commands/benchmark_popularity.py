@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+from goods import popularity
+import random
+import time
+
+
+class Command(BaseCommand):
+    """测试人气排行在大量商品时查询前N名的耗时，使用单独的测试排行，不影响线上数据
+
+    python manage.py benchmark_popularity
+    python manage.py benchmark_popularity --skus 1000000 --top 10 --queries 1000
+    """
+    help = "测试人气排行查询前N名的耗时"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--skus", type=int, default=1000000, help="排行中的商品数目")
+        parser.add_argument("--top", type=int, default=10, help="每次查询的商品数目")
+        parser.add_argument("--queries", type=int, default=1000, help="查询的次数")
+
+    def handle(self, *args, **options):
+        redis_conn = get_redis_connection("default")
+        key = "hot_benchmark"
+        redis_conn.delete(key, popularity.EPOCH_KEY % key)
+
+        # 生成测试数据
+        start = time.time()
+        chunk = 10000
+        for i in range(0, options["skus"], chunk):
+            args = []
+            for sku_id in range(i + 1, min(i + chunk, options["skus"]) + 1):
+                args.extend([random.random() * 1000, sku_id])
+            redis_conn.execute_command("ZADD", key, *args)
+        self.stdout.write("写入%d个商品: %.2fs" % (options["skus"], time.time() - start))
+
+        try:
+            # 查询前N名
+            latencies = []
+            for _ in range(options["queries"]):
+                start = time.time()
+                redis_conn.zrevrange(key, 0, options["top"] - 1, withscores=True)
+                latencies.append(time.time() - start)
+            latencies.sort()
+            self.stdout.write("前%d名: 平均 %.3fms, p50 %.3fms, p99 %.3fms" % (
+                options["top"], sum(latencies) / len(latencies) * 1000,
+                latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000))
+
+            # 整理排行（衰减分数）
+            redis_conn.set(popularity.EPOCH_KEY % key, time.time() - 3600)
+            start = time.time()
+            popularity.compact(key, redis_conn=redis_conn)
+            self.stdout.write("整理排行: %.2fs" % (time.time() - start))
+        finally:
+            redis_conn.delete(key, popularity.EPOCH_KEY % key)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from goods import inventory
+
+
+class Command(BaseCommand):
+    """检查redis中的库存计数器与mysql中的库存是否一致
+
+    python manage.py check_inventory
+    python manage.py check_inventory --fix
+    """
+    help = "检查redis中的库存计数器与mysql中的库存是否一致"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sku", action="append", type=int, dest="sku_ids", help="要检查的商品id，默认检查所有商品")
+        parser.add_argument("--fix", action="store_true", default=False, help="重建不一致的商品的库存计数器")
+
+    def handle(self, *args, **options):
+        drift = inventory.check_drift(options["sku_ids"])
+        for sku_id, actual, expected in drift:
+            self.stdout.write("商品%s: redis中的库存%s, 应该为%s" % (sku_id, actual, expected))
+
+        if not drift:
+            self.stdout.write("redis中的库存与mysql一致")
+        elif options["fix"]:
+            inventory.rebuild([sku_id for sku_id, _, _ in drift])
+            self.stdout.write("重建了%d个商品的库存计数器" % len(drift))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from goods import inventory
+
+
+class Command(BaseCommand):
+    """根据mysql中的库存重建redis中的库存计数器
+
+    python manage.py rebuild_inventory
+    python manage.py rebuild_inventory --sku 1 --sku 2
+    """
+    help = "根据mysql中的库存重建redis中的库存计数器"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sku", action="append", type=int, dest="sku_ids", help="要重建的商品id，默认重建所有商品")
+
+    def handle(self, *args, **options):
+        stock = inventory.rebuild(options["sku_ids"])
+        self.stdout.write("重建了%d个商品的库存计数器" % len(stock))
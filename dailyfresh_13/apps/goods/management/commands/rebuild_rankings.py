@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from goods.models import GoodsCategory
+from goods import rankings
+
+
+class Command(BaseCommand):
+    """根据数据库重建商品列表页的排序索引
+
+    python manage.py rebuild_rankings
+    python manage.py rebuild_rankings --category 1 --category 2
+    """
+    help = "根据数据库重建商品列表页的排序索引"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--category", action="append", type=int, dest="category_ids",
+                            help="要重建的分类id，默认重建所有分类")
+
+    def handle(self, *args, **options):
+        category_ids = options["category_ids"] or GoodsCategory.objects.values_list("id", flat=True)
+        for category_id in category_ids:
+            count = rankings.rebuild(category_id)
+            self.stdout.write("分类%s: %d个商品" % (category_id, count))
@@ -0,0 +1,130 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections as db_connections
+from django.utils import timezone
+from haystack import connections
+from whoosh.index import create_in
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from goods.models import GoodsSKU
+from goods import search_queue
+from utils.db_router import choose_replica
+import os
+import shutil
+import time
+
+# 子进程中使用的haystack后端和索引类
+_backend = None
+_index = None
+
+
+def _render(skus):
+    """在子进程中生成商品的索引文档"""
+    global _backend, _index
+    if _backend is None:
+        _backend = connections["default"].get_backend()
+        _index = connections["default"].get_unified_index().get_index(GoodsSKU)
+
+    return search_queue.prepare_documents(_backend, _index, skus)
+
+
+class Command(BaseCommand):
+    """多进程重建商品的搜索索引
+
+    在新的目录中生成索引，完成之后通过符号链接原子地替换正在使用的索引，重建过程中搜索使用旧的索引
+    重建过程中修改的商品在替换之后重新记录到search_queue中，由celery任务更新到新的索引
+    HAYSTACK_CONNECTIONS中的PATH第一次会从目录改为指向索引目录的符号链接
+
+    python manage.py rebuild_search_index
+    python manage.py rebuild_search_index --workers 8 --chunk 1000
+    """
+    help = "多进程重建商品的搜索索引"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="生成索引文档的进程数")
+        parser.add_argument("--chunk", type=int, default=1000, help="每次查询和交给子进程的商品数目")
+        parser.add_argument("--database", default=None, help="查询商品的数据库，默认选择一个可用的从数据库")
+
+    def iter_chunks(self, index, database, chunk):
+        """按照主键分批查询需要索引的商品"""
+        queryset = index.index_queryset().using(database).select_related("goods", "category").order_by("id")
+        last_id = 0
+        while True:
+            skus = list(queryset.filter(id__gt=last_id)[:chunk])
+            if not skus:
+                return
+            last_id = skus[-1].id
+            yield skus
+
+    def handle(self, *args, **options):
+        path = settings.HAYSTACK_CONNECTIONS["default"]["PATH"].rstrip(os.sep)
+        database = options["database"] or choose_replica() or "default"
+        backend = connections["default"].get_backend()
+        index = connections["default"].get_unified_index().get_index(GoodsSKU)
+
+        # 在查询商品之前记录开始的时间，之后修改的商品可能没有写入新的索引
+        start = time.time()
+        started_at = timezone.now()
+
+        # 在新的目录中创建索引，同时运行的多个命令使用不同的目录
+        new_path = "%s_%s_%d" % (path, time.strftime("%Y%m%d%H%M%S"), os.getpid())
+        os.makedirs(new_path)
+        _, schema = backend.build_schema(connections["default"].get_unified_index().all_searchfields())
+        writer = create_in(new_path, schema).writer()
+
+        # 子进程复制父进程的数据库连接会出错，创建子进程之前关闭
+        for conn in db_connections.all():
+            conn.close()
+
+        count = 0
+        try:
+            with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+                # 最多同时有workers*2批商品在处理，不会一次性把所有商品读到内存中
+                futures = deque()
+                for skus in self.iter_chunks(index, database, options["chunk"]):
+                    futures.append(executor.submit(_render, skus))
+                    if len(futures) >= options["workers"] * 2:
+                        count += self.write(writer, futures.popleft().result())
+                while futures:
+                    count += self.write(writer, futures.popleft().result())
+            writer.commit()
+        except BaseException:
+            writer.cancel()
+            shutil.rmtree(new_path, ignore_errors=True)
+            raise
+        seconds = time.time() - start
+
+        old_path = self.swap(path, new_path)
+        if old_path:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+        # 重建过程中修改的商品，更新任务可能已经写到了旧的索引中，重新记录
+        changed = list(GoodsSKU.objects.using("default").filter(update_time__gte=started_at).values_list(
+            "id", flat=True))
+        search_queue.mark_dirty(*changed)
+
+        self.stdout.write("索引了%d个商品: %.2fs, %.1f个/s, 重建过程中修改了%d个商品" % (
+            count, seconds, count / seconds if seconds else 0, len(changed)))
+
+    def write(self, writer, documents):
+        for document in documents:
+            writer.add_document(**document)
+        return len(documents)
+
+    def swap(self, path, new_path):
+        """将path指向新的索引目录，返回原来的索引目录"""
+        old_path = None
+        if os.path.islink(path):
+            old_path = os.path.realpath(path)
+        elif os.path.exists(path):
+            # 第一次使用时path是目录，先移动到旁边
+            old_path = "%s_old_%d" % (path, time.time())
+            os.rename(path, old_path)
+
+        # 先创建临时的符号链接，再通过rename原子地替换
+        tmp_link = "%s.tmp" % path
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
+        os.symlink(new_path, tmp_link)
+        os.rename(tmp_link, path)
+        return old_path
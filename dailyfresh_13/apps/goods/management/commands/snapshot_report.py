@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from goods.models import GoodsSKU
+from goods.utils import get_index_context
+from goods.snapshots import snapshot_index, snapshot_detail, encode_snapshot
+from goods.views import DetailView
+import pickle
+
+
+class Command(BaseCommand):
+    """统计页面缓存数据使用快照之后节省的字节数
+
+    python manage.py snapshot_report
+    python manage.py snapshot_report --sku 1 --sku 2
+    """
+    help = "统计主页和商品详情页缓存数据使用快照之后节省的字节数"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sku", action="append", type=int, dest="sku_ids", help="要统计的商品id，默认统计前10个商品")
+
+    def handle(self, *args, **options):
+        sku_ids = options["sku_ids"]
+        if not sku_ids:
+            sku_ids = list(GoodsSKU.objects.order_by("id").values_list("id", flat=True)[:10])
+
+        rows = [("index_page_data", get_index_context(), snapshot_index)]
+        view = DetailView()
+        for sku_id in sku_ids:
+            context = view.get_context(sku_id)
+            if context is None:
+                self.stderr.write("商品%s不存在" % sku_id)
+                continue
+            rows.append(("detail_%s" % sku_id, context, snapshot_detail))
+
+        self.stdout.write("%-20s %12s %12s %12s %8s" % ("key", "pickle", "snapshot", "saved", "ratio"))
+        total_pickle = total_snapshot = 0
+        for key, context, snapshot in rows:
+            # 与django_redis默认的序列化方式相同
+            pickle_size = len(pickle.dumps(context, pickle.HIGHEST_PROTOCOL))
+            snapshot_size = len(encode_snapshot(snapshot(context)))
+            total_pickle += pickle_size
+            total_snapshot += snapshot_size
+            self.stdout.write("%-20s %12d %12d %12d %7.1f%%" % (
+                key, pickle_size, snapshot_size, pickle_size - snapshot_size,
+                100.0 * (pickle_size - snapshot_size) / pickle_size))
+
+        self.stdout.write("%-20s %12d %12d %12d" % ("total", total_pickle, total_snapshot, total_pickle - total_snapshot))
@@ -0,0 +1,150 @@
+from django.conf import settings
+from django_redis import get_redis_connection
+from goods.utils import get_skus
+import math
+import time
+
+# 商品人气排行，保存在redis的有序集合中，成员是商品id，分数是随时间衰减的销量
+# 使用前向衰减：t时刻卖出count件时，分数增加 count * e^((t - 基准时间) / tau)，
+# 所有商品的分数同比例衰减不影响排名，因此只在整理时将分数乘以 e^((基准时间 - 现在) / tau) 并把基准时间改为现在，避免分数过大
+
+# 全站人气排行
+GLOBAL_KEY = "hot_global"
+# 分类人气排行，包含分类中所有上线的商品（没有销量的商品分数为0），列表页按照人气排序时使用
+CATEGORY_KEY = "hot_cat_%s"
+# 每个排行的基准时间
+EPOCH_KEY = "%s_epoch"
+
+# 记录销量 KEYS: 排行, 基准时间, 排行, 基准时间, ...  ARGV: 现在, tau, 下单时间, 数量, 商品id, 下单时间, 数量, 商品id, ...
+# 取消订单时数量为负数，按照下单时间计算权重，正好减去下单时增加的分数；不在排行中的商品不再减少，分数不小于0
+RECORD = """
+local now = tonumber(ARGV[1])
+local tau = tonumber(ARGV[2])
+for i = 1, #KEYS, 2 do
+    local j = 3 + (i - 1) / 2 * 3
+    local count = tonumber(ARGV[j + 1])
+    local member = ARGV[j + 2]
+    local epoch = redis.call("GET", KEYS[i + 1])
+    if not epoch then
+        epoch = ARGV[1]
+        redis.call("SET", KEYS[i + 1], epoch)
+    end
+    if count > 0 or redis.call("ZSCORE", KEYS[i], member) then
+        local weight = math.exp((tonumber(ARGV[j]) - tonumber(epoch)) / tau)
+        local score = tonumber(redis.call("ZINCRBY", KEYS[i], count * weight, member))
+        if score < 0 then
+            redis.call("ZADD", KEYS[i], 0, member)
+        end
+    end
+end
+return 0
+"""
+
+# 整理排行 KEYS: 排行, 基准时间  ARGV: 现在, tau, 保留的商品数目（0表示不删除）, 删除低于这个分数的商品（空表示不删除）
+COMPACT = """
+local now = tonumber(ARGV[1])
+local epoch = redis.call("GET", KEYS[2])
+redis.call("SET", KEYS[2], ARGV[1])
+if epoch and redis.call("EXISTS", KEYS[1]) == 1 then
+    local factor = math.exp((tonumber(epoch) - now) / tonumber(ARGV[2]))
+    redis.call("ZUNIONSTORE", KEYS[1], 1, KEYS[1], "WEIGHTS", factor)
+end
+if ARGV[4] ~= "" then
+    redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", "(" .. ARGV[4])
+end
+local max_members = tonumber(ARGV[3])
+if max_members > 0 then
+    redis.call("ZREMRANGEBYRANK", KEYS[1], 0, -max_members - 1)
+end
+return redis.call("ZCARD", KEYS[1])
+"""
+
+_scripts = {}
+
+
+def _run(redis_conn, script, keys, args):
+    if script not in _scripts:
+        _scripts[script] = redis_conn.register_script(script)
+    return _scripts[script](keys=keys, args=args, client=redis_conn)
+
+
+def _tau():
+    """衰减的时间常数，经过一个半衰期分数减半"""
+    return settings.GOODS_HOT["HALF_LIFE"] / math.log(2)
+
+
+def _record(sales, redis_conn=None):
+    """sales: [(分类id, 商品id, 数量, 下单时间戳)]"""
+    if not sales:
+        return
+    redis_conn = redis_conn or get_redis_connection("default")
+    keys = []
+    args = [time.time(), _tau()]
+    for category_id, sku_id, count, at in sales:
+        for key in (GLOBAL_KEY, CATEGORY_KEY % category_id):
+            keys.extend([key, EPOCH_KEY % key])
+            args.extend([at, count, sku_id])
+    _run(redis_conn, RECORD, keys, args)
+
+
+def record(sales, redis_conn=None):
+    """下单之后记录商品的销量
+
+    :param sales: [(分类id, 商品id, 数量)]
+    """
+    now = time.time()
+    _record([(category_id, sku_id, count, now) for category_id, sku_id, count in sales], redis_conn)
+
+
+def cancel(sales, redis_conn=None):
+    """订单取消之后减去下单时记录的销量
+
+    :param sales: [(分类id, 商品id, 数量, 下单时间)]
+    """
+    _record([(category_id, sku_id, -count, create_time.timestamp())
+             for category_id, sku_id, count, create_time in sales], redis_conn)
+
+
+def compact(key, max_members=0, min_score="", redis_conn=None):
+    """整理一个排行：衰减分数并更新基准时间，删除分数过低或排名靠后的商品，返回剩余的商品数目"""
+    redis_conn = redis_conn or get_redis_connection("default")
+    return _run(redis_conn, COMPACT, [key, EPOCH_KEY % key], [time.time(), _tau(), max_members, min_score])
+
+
+def compact_all(category_ids, redis_conn=None):
+    """整理全站和所有分类的排行，分类排行需要包含所有上线的商品，只衰减不删除"""
+    redis_conn = redis_conn or get_redis_connection("default")
+    config = settings.GOODS_HOT
+    result = {GLOBAL_KEY: compact(GLOBAL_KEY, config["MAX_MEMBERS"], config["MIN_SCORE"], redis_conn)}
+    for category_id in category_ids:
+        key = CATEGORY_KEY % category_id
+        result[key] = compact(key, redis_conn=redis_conn)
+    return result
+
+
+def sync_members(key, members_key, redis_conn=None):
+    """让排行中的商品与members_key中的商品相同，新增的商品分数为0，已有商品的分数不变"""
+    redis_conn = redis_conn or get_redis_connection("default")
+    tmp_key = key + "_syncing"
+    pipe = redis_conn.pipeline()
+    # 并集：members_key中的商品分数为0，加上排行中的分数
+    pipe.zunionstore(tmp_key, {members_key: 0, key: 1})
+    # 交集：只保留members_key中的商品
+    pipe.zinterstore(key, {tmp_key: 1, members_key: 0})
+    pipe.delete(tmp_key)
+    pipe.execute()
+
+
+def top_sku_ids(category_id=None, num=10, redis_conn=None):
+    """人气最高的商品id，category_id为None时返回全站排行"""
+    redis_conn = redis_conn or get_redis_connection("default")
+    key = GLOBAL_KEY if category_id is None else CATEGORY_KEY % category_id
+    return [int(sku_id) for sku_id in redis_conn.zrevrange(key, 0, num - 1)]
+
+
+def get_trending_skus(num=None):
+    """主页展示的全站人气商品，只包含上线的商品"""
+    num = num or settings.GOODS_HOT["TRENDING_NUM"]
+    # 多取一些，过滤掉下线的商品
+    skus, _ = get_skus(top_sku_ids(num=num * 2), use_cache=True)
+    return [sku for sku in skus if sku.status][:num]
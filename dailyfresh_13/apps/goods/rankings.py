@@ -0,0 +1,160 @@
+from django_redis import get_redis_connection
+from goods.models import GoodsSKU
+from goods.utils import get_skus
+from goods import popularity
+import time
+
+# 商品列表页使用的每个分类的排序索引，保存在redis的有序集合中，成员是商品id，分数是排序的字段
+# 只包含上线的商品，列表页按照排名取出一页商品id，再批量查询商品，不再执行 count(*) 和 order by ... offset
+RANK_KEY = "rank_%s_%s"  # 分类id, 排序方式
+
+# 排序方式: (计算分数的函数, 是否从大到小)
+SORTS = {
+    "default": (lambda sku: sku.id, False),
+    "price": (lambda sku: float(sku.price), False),
+    "new": (lambda sku: time.mktime(sku.create_time.timetuple()), True),
+}
+
+# 按照人气排序使用popularity中随时间衰减的分类排行，商品与default索引保持一致
+HOT_SORT = "hot"
+
+
+def _keys(category_id):
+    """分类的所有排序索引"""
+    return [RANK_KEY % (category_id, sort) for sort in SORTS] + [popularity.CATEGORY_KEY % category_id]
+
+# 只有索引存在时才修改，不存在的索引在使用时从数据库完整重建，避免生成只有部分商品的索引
+# 设置分数 KEYS: 索引...  ARGV: 商品id, 分数...
+ZADD_IF_EXISTS = """
+for i = 1, #KEYS do
+    if redis.call("EXISTS", KEYS[i]) == 1 then
+        redis.call("ZADD", KEYS[i], ARGV[i + 1], ARGV[1])
+    end
+end
+return 0
+"""
+
+_scripts = {}
+
+# 重建索引时每次写入redis的商品数目
+REBUILD_CHUNK = 1000
+
+
+def _run(redis_conn, script, keys, args):
+    if script not in _scripts:
+        _scripts[script] = redis_conn.register_script(script)
+    return _scripts[script](keys=keys, args=args, client=redis_conn)
+
+
+def rebuild(category_id, redis_conn=None):
+    """根据数据库重建一个分类的所有排序索引，返回商品数目"""
+    redis_conn = redis_conn or get_redis_connection("default")
+    skus = list(GoodsSKU.objects.filter(category_id=category_id, status=True).only(
+        "id", "price", "sales", "create_time"))
+
+    pipe = redis_conn.pipeline()
+    for sort, (score, _) in SORTS.items():
+        key = RANK_KEY % (category_id, sort)
+        tmp_key = key + "_rebuilding"
+        pipe.delete(tmp_key)
+        for i in range(0, len(skus), REBUILD_CHUNK):
+            # ZADD key score member score member ...，不依赖redis-py中zadd的参数格式
+            args = []
+            for sku in skus[i:i + REBUILD_CHUNK]:
+                args.extend([score(sku), sku.id])
+            pipe.execute_command("ZADD", tmp_key, *args)
+        if skus:
+            # 写完之后再替换，读取的一方不会看到只有部分商品的索引
+            pipe.rename(tmp_key, key)
+        else:
+            pipe.delete(key)
+    pipe.execute()
+    # 人气排行保留已有的分数，只同步其中的商品
+    popularity.sync_members(popularity.CATEGORY_KEY % category_id, RANK_KEY % (category_id, "default"), redis_conn)
+    return len(skus)
+
+
+def update_sku(sku, category_ids=(), redis_conn=None):
+    """商品保存之后更新排序索引，下线的商品从索引中删除
+
+    :param category_ids: 商品可能存在的其他分类，修改了商品的分类时从原来分类的索引中删除
+    """
+    redis_conn = redis_conn or get_redis_connection("default")
+    pipe = redis_conn.pipeline()
+    for category_id in set(category_ids) - {sku.category_id, None}:
+        for key in _keys(category_id):
+            pipe.zrem(key, sku.id)
+    if sku.status:
+        # 人气排行中缺少的商品在使用时同步
+        keys = [RANK_KEY % (sku.category_id, sort) for sort in SORTS]
+        args = [sku.id] + [score(sku) for score, _ in SORTS.values()]
+        _run(pipe, ZADD_IF_EXISTS, keys, args)
+    else:
+        for key in _keys(sku.category_id):
+            pipe.zrem(key, sku.id)
+    pipe.execute()
+
+
+def remove_sku(sku, redis_conn=None):
+    """商品删除之后从排序索引中删除"""
+    redis_conn = redis_conn or get_redis_connection("default")
+    pipe = redis_conn.pipeline()
+    for key in _keys(sku.category_id):
+        pipe.zrem(key, sku.id)
+    pipe.execute()
+
+
+class RankedSKUs(object):
+    """按照排序索引取出的分类商品，可以直接交给Paginator分页，切片时只查询这一页的商品"""
+    def __init__(self, category_id, sort="default", redis_conn=None):
+        self.redis_conn = redis_conn or get_redis_connection("default")
+        self.category_id = category_id
+        self.sort = sort
+        if sort == HOT_SORT:
+            self.key = popularity.CATEGORY_KEY % category_id
+            self.reverse = True
+        else:
+            self.key = RANK_KEY % (category_id, sort)
+            self.reverse = SORTS[sort][1]
+        self._count = None
+
+    def _ensure_index(self):
+        """索引不存在时从数据库重建"""
+        if self._count is None:
+            if self.sort == HOT_SORT:
+                # 人气排行中的商品与default索引不一致时（新上线的商品、下单时才加入排行的分类）先同步
+                default_key = RANK_KEY % (self.category_id, "default")
+                pipe = self.redis_conn.pipeline()
+                pipe.zcard(default_key)
+                pipe.zcard(self.key)
+                self._count, hot_count = pipe.execute()
+                if self._count == 0:
+                    self._count = rebuild(self.category_id, self.redis_conn)
+                elif hot_count != self._count:
+                    popularity.sync_members(self.key, default_key, self.redis_conn)
+            else:
+                self._count = self.redis_conn.zcard(self.key)
+                if self._count == 0:
+                    self._count = rebuild(self.category_id, self.redis_conn)
+        return self._count
+
+    def count(self):
+        return self._ensure_index()
+
+    def __len__(self):
+        return self._ensure_index()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        stop = index.stop if index.stop is not None else self._ensure_index()
+        if stop <= start:
+            return []
+        self._ensure_index()
+        if self.reverse:
+            sku_ids = self.redis_conn.zrevrange(self.key, start, stop - 1)
+        else:
+            sku_ids = self.redis_conn.zrange(self.key, start, stop - 1)
+        skus, _ = get_skus(sku_ids, use_cache=True)
+        return skus
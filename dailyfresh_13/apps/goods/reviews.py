@@ -0,0 +1,74 @@
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from orders.models import OrderGoods
+from datetime import datetime
+
+# 每次返回的评论条数
+REVIEWS_PAGE_SIZE = 30
+
+# 商品第一页评论的缓存
+REVIEWS_CACHE_KEY = "reviews_%s"
+REVIEWS_CACHE_TIMEOUT = 3600
+
+# 分页游标中时间的格式
+CURSOR_TIME_FORMAT = "%Y%m%d%H%M%S%f"
+
+
+def _encode_cursor(order_goods):
+    """根据最后一条评论生成下一页的游标 "时间_id" """
+    create_time = order_goods.create_time.astimezone(timezone.utc)
+    return "%s_%s" % (create_time.strftime(CURSOR_TIME_FORMAT), order_goods.id)
+
+
+def _decode_cursor(cursor):
+    """解析游标，游标格式不正确时抛出ValueError"""
+    create_time, order_goods_id = cursor.split("_")
+    create_time = datetime.strptime(create_time, CURSOR_TIME_FORMAT).replace(tzinfo=timezone.utc)
+    return create_time, int(order_goods_id)
+
+
+def query_reviews(sku_id, cursor=None, limit=REVIEWS_PAGE_SIZE):
+    """查询商品的评论，按照评论时间从新到旧，使用游标分页
+
+    :param sku_id: 商品id
+    :param cursor: 上一页返回的游标，None表示第一页
+    :param limit: 返回的评论条数
+    :return: {"reviews": [{"username", "ctime", "comment"}, ...], "next": 下一页的游标，没有下一页时为None}
+    """
+    # 只查询有评论内容的订单商品，同时查出下单的用户，避免每条评论再查询两次数据库
+    order_goods = OrderGoods.objects.filter(sku_id=sku_id).exclude(comment="").select_related("order__user")
+    if cursor is not None:
+        create_time, order_goods_id = _decode_cursor(cursor)
+        order_goods = order_goods.filter(Q(create_time__lt=create_time) |
+                                         Q(create_time=create_time, id__lt=order_goods_id))
+    # 多查询一条，用来判断是否还有下一页
+    order_goods = list(order_goods.order_by("-create_time", "-id")[:limit + 1])
+
+    next_cursor = None
+    if len(order_goods) > limit:
+        order_goods = order_goods[:limit]
+        next_cursor = _encode_cursor(order_goods[-1])
+
+    reviews = []
+    for item in order_goods:
+        reviews.append({
+            "username": item.order.user.username,
+            "ctime": timezone.localtime(item.create_time).strftime("%Y-%m-%d %H:%M:%S"),
+            "comment": item.comment,
+        })
+    return {"reviews": reviews, "next": next_cursor}
+
+
+def get_reviews(sku_id):
+    """获取商品第一页的评论，使用缓存"""
+    reviews = cache.get(REVIEWS_CACHE_KEY % sku_id)
+    if reviews is None:
+        reviews = query_reviews(sku_id)
+        cache.set(REVIEWS_CACHE_KEY % sku_id, reviews, REVIEWS_CACHE_TIMEOUT)
+    return reviews
+
+
+def clear_reviews_cache(*sku_ids):
+    """商品有了新的评论，清除评论的缓存"""
+    cache.delete_many([REVIEWS_CACHE_KEY % sku_id for sku_id in sku_ids])
@@ -11,5 +11,5 @@ class GoodsSKUIndex(indexes.SearchIndex, indexes.Indexable):
         return GoodsSKU
 
     def index_queryset(self, using=None):
-        """"""
-        return self.get_model().objects.all()
+        """只索引上线的商品"""
+        return self.get_model().objects.filter(status=True)
@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.db.models import signals
+from django_redis import get_redis_connection
+from haystack import connections
+from haystack.constants import ID
+from haystack.signals import BaseSignalProcessor
+from redis.exceptions import ResponseError
+from whoosh.writing import AsyncWriter
+from goods.models import GoodsSKU
+
+# 商品修改之后不在请求中更新whoosh索引，只将商品id记录到redis的集合中，由celery任务批量更新索引
+
+# 需要更新索引的商品id
+DIRTY_KEY = "search_dirty_skus"
+# 正在更新索引的商品id
+SYNCING_KEY = "search_dirty_skus_syncing"
+
+# 影响索引内容的字段，只修改了库存、销量等其他字段时不需要更新索引
+INDEXED_FIELDS = ("name", "title", "status")
+
+
+def _indexed_values(instance):
+    # 使用__dict__读取，延迟加载的字段不会触发查询
+    return tuple(instance.__dict__.get(field) for field in INDEXED_FIELDS)
+
+
+def prepare_documents(backend, index, skus):
+    """生成商品的索引文档，与haystack的whoosh后端update中的处理相同"""
+    documents = []
+    for sku in skus:
+        document = index.full_prepare(sku)
+        for key in document:
+            document[key] = backend._from_python(document[key])
+        document.pop("boost", None)
+        documents.append(document)
+    return documents
+
+
+def mark_dirty(*sku_ids):
+    """记录需要更新索引的商品"""
+    if sku_ids:
+        get_redis_connection("default").sadd(DIRTY_KEY, *sku_ids)
+
+
+class QueuedSignalProcessor(BaseSignalProcessor):
+    """商品保存或删除之后只记录商品id，代替RealtimeSignalProcessor
+
+    settings.HAYSTACK_SIGNAL_PROCESSOR = "goods.search_queue.QueuedSignalProcessor"
+    """
+    def setup(self):
+        signals.post_init.connect(self.handle_init, sender=GoodsSKU)
+        signals.post_save.connect(self.handle_save, sender=GoodsSKU)
+        signals.post_delete.connect(self.handle_delete, sender=GoodsSKU)
+
+    def teardown(self):
+        signals.post_init.disconnect(self.handle_init, sender=GoodsSKU)
+        signals.post_save.disconnect(self.handle_save, sender=GoodsSKU)
+        signals.post_delete.disconnect(self.handle_delete, sender=GoodsSKU)
+
+    def handle_init(self, sender, instance, **kwargs):
+        # 记录加载时索引字段的值
+        instance._indexed_values = _indexed_values(instance)
+
+    def handle_save(self, sender, instance, created=False, **kwargs):
+        values = _indexed_values(instance)
+        if created or values != getattr(instance, "_indexed_values", None):
+            mark_dirty(instance.id)
+        instance._indexed_values = values
+
+    def handle_delete(self, sender, instance, **kwargs):
+        mark_dirty(instance.id)
+
+
+def update_dirty(batch_size=None, using="default"):
+    """将记录的商品批量更新到索引中，更新和删除使用同一个writer，只提交一次索引，返回(更新的商品数, 删除的商品数)"""
+    batch_size = batch_size or settings.SEARCH_INDEX_BATCH
+    redis_conn = get_redis_connection("default")
+
+    # 上次更新失败时遗留的数据先处理，否则将记录的商品id原子地转移出来，之后修改的商品记录到新的集合中
+    if not redis_conn.exists(SYNCING_KEY):
+        try:
+            redis_conn.rename(DIRTY_KEY, SYNCING_KEY)
+        except ResponseError:
+            # 没有需要更新的商品
+            return 0, 0
+
+    sku_ids = sorted(int(sku_id) for sku_id in redis_conn.smembers(SYNCING_KEY))
+    backend = connections[using].get_backend()
+    index = connections[using].get_unified_index().get_index(GoodsSKU)
+
+    # 分批从主数据库查询仍然需要索引的商品，避免读到从数据库中还没有同步的旧数据
+    skus = []
+    for i in range(0, len(sku_ids), batch_size):
+        skus.extend(index.index_queryset(using=using).using("default").filter(id__in=sku_ids[i:i + batch_size]))
+
+    # 删除和下线的商品从索引中删除
+    found = {sku.id for sku in skus}
+    removed = [sku_id for sku_id in sku_ids if sku_id not in found]
+
+    if not backend.setup_complete:
+        backend.setup()
+    backend.index = backend.index.refresh()
+    writer = AsyncWriter(backend.index)
+    try:
+        for sku_id in removed:
+            writer.delete_by_term(ID, "goods.goodssku.%s" % sku_id)
+        for document in prepare_documents(backend, index, skus):
+            writer.update_document(**document)
+    except BaseException:
+        writer.cancel()
+        raise
+    writer.commit()
+
+    redis_conn.delete(SYNCING_KEY)
+    return len(skus), len(removed)
@@ -0,0 +1,78 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from goods.models import GoodsCategory, Goods, GoodsSKU, GoodsImage
+from goods.models import IndexGoodsBanner, IndexCategoryGoodsBanner, IndexPromotionBanner
+from django.core.cache import cache
+from goods.utils import SKU_CACHE_KEY, clear_category_count
+from goods import inventory
+from goods import rankings
+from utils.cache import bump_tags
+
+
+# 模型数据保存或删除后，只增加受影响的缓存标签的版本号，而不是清除整个页面的缓存
+
+
+@receiver([post_save, post_delete], sender=GoodsCategory)
+def category_changed(sender, instance, **kwargs):
+    bump_tags("categorys", "category_%s" % instance.id)
+
+
+@receiver([post_save, post_delete], sender=Goods)
+def goods_changed(sender, instance, **kwargs):
+    bump_tags("goods_%s" % instance.id)
+
+
+@receiver(post_init, sender=GoodsSKU)
+def sku_loaded(sender, instance, **kwargs):
+    # 记录商品原来的分类和上线状态，修改分类之后从原来分类的排序索引中删除
+    # 使用__dict__读取，延迟加载的字段不会触发查询
+    instance._origin_category_id = instance.__dict__.get("category_id")
+    instance._origin_status = instance.__dict__.get("status")
+    instance._origin_stock = instance.__dict__.get("stock")
+
+
+@receiver([post_save, post_delete], sender=GoodsSKU)
+def sku_changed(sender, instance, **kwargs):
+    bump_tags("sku_%s" % instance.id, "category_%s" % instance.category_id, "goods_%s" % instance.goods_id)
+    cache.delete(SKU_CACHE_KEY % instance.id)
+    if kwargs["signal"] is post_save:
+        origin_category_id = getattr(instance, "_origin_category_id", None)
+        rankings.update_sku(instance, [origin_category_id])
+        # 新增商品、修改了分类或上线状态时，分类的商品数目变化了
+        if (kwargs["created"] or origin_category_id != instance.category_id or
+                getattr(instance, "_origin_status", None) != instance.status):
+            clear_category_count(*{origin_category_id or instance.category_id, instance.category_id})
+        origin_stock = getattr(instance, "_origin_stock", None)
+        stock = instance.__dict__.get("stock")
+        instance._origin_category_id = instance.category_id
+        instance._origin_status = instance.status
+        instance._origin_stock = stock
+        if inventory.is_enabled():
+            if kwargs["created"]:
+                inventory.init_missing([instance.id])
+            elif origin_stock is not None and stock is not None:
+                # 后台修改了库存，只把修改的数量加到redis的计数器上，不覆盖并发的预占
+                inventory.adjust({instance.id: stock - origin_stock})
+    else:
+        rankings.remove_sku(instance)
+        clear_category_count(instance.category_id)
+
+
+@receiver([post_save, post_delete], sender=GoodsImage)
+def image_changed(sender, instance, **kwargs):
+    bump_tags("sku_%s" % instance.sku_id)
+
+
+@receiver([post_save, post_delete], sender=IndexGoodsBanner)
+def index_banner_changed(sender, instance, **kwargs):
+    bump_tags("index_banners")
+
+
+@receiver([post_save, post_delete], sender=IndexCategoryGoodsBanner)
+def category_banner_changed(sender, instance, **kwargs):
+    bump_tags("index_category_banners")
+
+
+@receiver([post_save, post_delete], sender=IndexPromotionBanner)
+def promotion_banner_changed(sender, instance, **kwargs):
+    bump_tags("index_promotions")
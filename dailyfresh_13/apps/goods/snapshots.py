@@ -0,0 +1,90 @@
+from django.conf import settings
+import json
+import zlib
+
+# 快照数据结构的版本号，修改了快照的字段之后需要增加版本号，旧版本的缓存数据会被当作不存在
+SNAPSHOT_VERSION = 2
+
+# 数据格式的标识
+FORMAT_JSON = b"j"
+FORMAT_ZLIB = b"z"
+
+
+def encode_snapshot(data):
+    """将快照数据转换为紧凑的bytes，超过设置的大小时进行压缩"""
+    data = dict(data, v=SNAPSHOT_VERSION)
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+    if len(raw) > settings.SNAPSHOT_COMPRESS_THRESHOLD:
+        return FORMAT_ZLIB + zlib.compress(raw)
+    return FORMAT_JSON + raw
+
+
+def decode_snapshot(raw):
+    """将bytes转换为快照数据， 格式或版本不对时返回None"""
+    fmt, raw = raw[:1], raw[1:]
+    if fmt == FORMAT_ZLIB:
+        raw = zlib.decompress(raw)
+    elif fmt != FORMAT_JSON:
+        return None
+    data = json.loads(raw.decode())
+    if data.pop("v", None) != SNAPSHOT_VERSION:
+        return None
+    return data
+
+
+def _image(image):
+    """模板中使用image.url"""
+    return {"url": image.url}
+
+
+def _category(category):
+    return {"id": category.id, "name": category.name, "logo": category.logo}
+
+
+def _sku(sku):
+    """商品列表展示使用的字段"""
+    return {
+        "id": sku.id,
+        "name": sku.name,
+        "price": str(sku.price),
+        "unit": sku.unit,
+        "default_image": _image(sku.default_image),
+    }
+
+
+def snapshot_index(context):
+    """将主页的数据转换为只包含模板用到的字段的快照"""
+    categorys = []
+    for category in context["categorys"]:
+        item = _category(category)
+        item["image"] = _image(category.image)
+        item["title_banners"] = [{"sku": {"id": banner.sku.id, "name": banner.sku.name}}
+                                 for banner in category.title_banners]
+        item["image_banners"] = [{"sku": _sku(banner.sku)} for banner in category.image_banners]
+        categorys.append(item)
+
+    return {
+        "categorys": categorys,
+        "index_banners": [{"sku": {"id": banner.sku_id}, "image": _image(banner.image)}
+                          for banner in context["index_banners"]],
+        "promotion_banners": [{"url": banner.url, "image": _image(banner.image)}
+                              for banner in context["promotion_banners"]],
+    }
+
+
+def snapshot_detail(context):
+    """将商品详情页的数据转换为只包含模板用到的字段的快照"""
+    sku = context["sku"]
+    sku_data = _sku(sku)
+    sku_data.update({
+        "title": sku.title,
+        "category": {"id": sku.category.id, "name": sku.category.name},
+        "goods": {"id": sku.goods.id, "desc": sku.goods.desc},
+    })
+
+    return {
+        "categorys": [_category(category) for category in context["categorys"]],
+        "sku": sku_data,
+        "new_skus": [_sku(new_sku) for new_sku in context["new_skus"]],
+        "goods_skus": [_sku(goods_sku) for goods_sku in context["goods_skus"]],
+    }
@@ -4,5 +4,6 @@ from goods import views
 urlpatterns = [
     url(r"^index$", views.IndexView.as_view(), name="index"),
     url(r"^detail/(?P<sku_id>\d+)$", views.DetailView.as_view(), name="detail"),
+    url(r"^detail/(?P<sku_id>\d+)/reviews$", views.ReviewsView.as_view(), name="reviews"),
     url(r"^list/(?P<category_id>\d+)/(?P<page>\d+)$", views.ListView.as_view(), name="list"),
 ]
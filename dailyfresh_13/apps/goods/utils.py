@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.core.cache import cache
+from goods.models import GoodsCategory, IndexGoodsBanner, IndexPromotionBanner
+from goods.models import IndexCategoryGoodsBanner, GoodsSKU
+
+# 每个分类在主页上展示的商品数目（标题、图片各自的数目）
+INDEX_CATEGORY_BANNER_NUM = 4
+
+# 单个商品的缓存
+SKU_CACHE_KEY = "sku_%s"
+
+# 分类中上线商品数目的缓存，商品增加、删除、上下线时清除
+CATEGORY_COUNT_KEY = "category_count_%s"
+CATEGORY_COUNT_TIMEOUT = 3600
+
+
+def get_index_context():
+    """查询主页需要的数据，主页视图和生成静态主页的celery任务共用"""
+    # 商品分类信息
+    categorys = list(GoodsCategory.objects.all())
+
+    # 首页轮播图信息, 按照index排序
+    index_goods_banners = IndexGoodsBanner.objects.all().select_related("sku").order_by("index")
+
+    # 首页广告活动
+    promotions_banners = IndexPromotionBanner.objects.all().order_by("index")
+
+    # 分类商品展示  标题和图片
+    # 一次性查出所有分类的展示商品，再在python中按照分类和展示类型分组，避免每个分类都查询两次数据库
+    category_banners = {}
+    banners = IndexCategoryGoodsBanner.objects.all().select_related("sku").order_by("index")
+    for banner in banners:
+        # category_banners = {(category_id, display_type): [banner, ...]}
+        group = category_banners.setdefault((banner.category_id, banner.display_type), [])
+        if len(group) < INDEX_CATEGORY_BANNER_NUM:
+            group.append(banner)
+
+    for category in categorys:
+        category.title_banners = category_banners.get((category.id, 0), [])
+        category.image_banners = category_banners.get((category.id, 1), [])
+
+    context = {
+        "categorys": categorys,
+        "index_banners": index_goods_banners,
+        "promotion_banners": promotions_banners,
+    }
+    return context
+
+
+def get_index_tags(context):
+    """主页缓存数据（快照）依赖的标签"""
+    tags = ["categorys", "index_banners", "index_category_banners", "index_promotions"]
+    for banner in context["index_banners"]:
+        tags.append("sku_%s" % banner["sku"]["id"])
+    for category in context["categorys"]:
+        for banner in category["title_banners"] + category["image_banners"]:
+            tags.append("sku_%s" % banner["sku"]["id"])
+    return tags
+
+
+def get_detail_tags(context):
+    """商品详情页缓存数据（快照）依赖的标签"""
+    sku = context["sku"]
+    return ["categorys", "sku_%s" % sku["id"], "category_%s" % sku["category"]["id"], "goods_%s" % sku["goods"]["id"]]
+
+
+def get_skus(sku_ids, use_cache=False):
+    """按照sku_ids的顺序批量查询商品
+
+    :param sku_ids: 商品id列表，可以是从redis中取出的bytes
+    :param use_cache: 是否先从缓存中读取商品，不需要准确库存的页面使用
+    :return: (按照sku_ids顺序的商品列表, 不存在的商品id列表)
+    """
+    sku_ids = [int(sku_id) for sku_id in sku_ids]
+    skus = {}
+
+    if use_cache:
+        cached = cache.get_many([SKU_CACHE_KEY % sku_id for sku_id in sku_ids])
+        for sku in cached.values():
+            skus[sku.id] = sku
+
+    # 缓存中没有的商品，一次性从数据库中查出
+    query_ids = set(sku_ids) - set(skus)
+    if query_ids:
+        queried = {sku.id: sku for sku in GoodsSKU.objects.filter(id__in=query_ids)}
+        if use_cache and queried:
+            cache.set_many({SKU_CACHE_KEY % sku_id: sku for sku_id, sku in queried.items()}, settings.SKU_CACHE_TIMEOUT)
+        skus.update(queried)
+
+    # id__in查询出来的顺序与sku_ids不同，按照sku_ids重新排序
+    result = [skus[sku_id] for sku_id in sku_ids if sku_id in skus]
+    missing = [sku_id for sku_id in sku_ids if sku_id not in skus]
+    return result, missing
+
+
+def get_category_count(category_id):
+    """分类中上线的商品数目，使用缓存"""
+    count = cache.get(CATEGORY_COUNT_KEY % category_id)
+    if count is None:
+        count = GoodsSKU.objects.filter(category_id=category_id, status=True).count()
+        cache.set(CATEGORY_COUNT_KEY % category_id, count, CATEGORY_COUNT_TIMEOUT)
+    return count
+
+
+def clear_category_count(*category_ids):
+    """清除分类商品数目的缓存"""
+    cache.delete_many([CATEGORY_COUNT_KEY % category_id for category_id in category_ids])
@@ -1,13 +1,20 @@
 from django.shortcuts import render, redirect
 from django.views.generic import View
-from goods.models import GoodsCategory, IndexGoodsBanner, IndexPromotionBanner
-from goods.models import IndexCategoryGoodsBanner, GoodsSKU, Goods
-from django.core.cache import cache
-from django_redis import get_redis_connection
-from orders.models import OrderGoods
-from django.http import Http404
+from goods.models import GoodsCategory, GoodsSKU, Goods
+from goods.utils import get_index_context, get_index_tags, get_detail_tags, get_category_count
+from goods.snapshots import snapshot_index, snapshot_detail, encode_snapshot, decode_snapshot
+from goods.reviews import get_reviews, query_reviews
+from goods.rankings import RankedSKUs
+from goods.popularity import get_trending_skus
+from cart.utils import RedisCart
+from users.history import record_history
+from utils.cache import get_or_compute
+from django.http import Http404, JsonResponse
 from django.core.urlresolvers import reverse
 from django.core.paginator import Paginator, EmptyPage
+from django.conf import settings
+from utils.paginator import KeysetPaginator
+from redis.exceptions import RedisError
 import json
 
 # Create your views here.
@@ -19,13 +26,8 @@ class BaseCartView(View):
         cart_num = 0
         # 如果用户登录，从redis中获取用户的购物车数据
         if request.user.is_authenticated():
-            # 从redis中取购物车数据
-            redis_conn = get_redis_connection("default")
-            # 返回一个字典数据
-            cart = redis_conn.hgetall("cart_%s" % request.user.id)
-            # cart = {"sku_1": "10", "sku_2": "11"}
-            for value in cart.values():
-                cart_num += int(value)
+            # 从redis中取购物车保存的商品总数
+            cart_num = RedisCart(request.user.id).total()
         else:
             # 用户未登录，从cookie中获取购物车数据
             cart_json = request.COOKIES.get("cart")
@@ -44,43 +46,21 @@ class IndexView(BaseCartView):
     """主页"""
     def get(self, request):
         """提供主页页面"""
-        # 尝试先从缓存中读取上次保存的数据
-        context = cache.get("index_page_data")
-
-        # 如果没有拿到数据，则表示缓存中没有备份，需要从新查询数据库
-        if context is None:
-            print("没有用上缓存，查询的数据库")
-            # 需要查询的数据
-            # 商品分类信息
-            categorys = GoodsCategory.objects.all()
-
-            # 首页轮播图信息, 按照index排序
-            index_goods_banners = IndexGoodsBanner.objects.all().order_by("index")
-
-            # 首页广告活动
-            promotions_banners = IndexPromotionBanner.objects.all().order_by("index")
-
-            # 分类商品展示  标题和图片
-            for category in categorys:
-                title_banners = IndexCategoryGoodsBanner.objects.filter(category=category, display_type=0).order_by("index")[:4]
-                category.title_banners = title_banners
-                image_banners = IndexCategoryGoodsBanner.objects.filter(category=category, display_type=1).order_by("index")[:4]
-                category.image_banners = image_banners
-
-            context = {
-                "categorys": categorys,
-                "index_banners": index_goods_banners,
-                "promotion_banners": promotions_banners,
-            }
-            # 将数据保存到缓存中（ 隐含的是通过django_redis保存到了redis中）
-            #                                    缓存的时间
-            cache.set("index_page_data", context, 3600)
+        # 尝试先从缓存中读取上次保存的数据, 依赖的数据有变化时读取不到
+        # 如果没有拿到数据，则表示缓存中没有备份，只由一个进程重新查询数据库，并保存到缓存中（通过django_redis保存到了redis中）
+        #                                                              缓存的时间
+        # 缓存中保存的是只包含模板用到的字段的快照数据
+        context = get_or_compute("index_page_data", lambda: snapshot_index(get_index_context()), 3600,
+                                 get_tags=get_index_tags, encode=encode_snapshot, decode=decode_snapshot)
 
         # 用户的购物车信息
         cart_num = self.get_cart_num(request)
 
+        # 人气商品，不放在主页的缓存中，下单之后就可以看到排行的变化
+        trending_skus = get_trending_skus()
+
         # 将购物车数量添加到模板变量中
-        context.update(cart_num=cart_num)
+        context.update(cart_num=cart_num, trending_skus=trending_skus)
 
         # 处理模板页面
         return render(request, "index.html", context)
@@ -88,71 +68,112 @@ class IndexView(BaseCartView):
 
 class DetailView(BaseCartView):
     """商品详细信息"""
-    def get(self, request, sku_id):
-        """提供页面"""
-        # 尝试获取缓存数据
-        context = cache.get("detail_%s" % sku_id)
-        # 如果缓存不存在
-        if context is None:
+    def get_context(self, sku_id):
+        """查询商品详情页面的数据, 商品不存在时返回None"""
+        try:
+            # 获取商品信息
+            sku = GoodsSKU.objects.get(id=sku_id)
+        except GoodsSKU.DoesNotExist:
+            return None
 
-            try:
-                # 获取商品信息
-                sku = GoodsSKU.objects.get(id=sku_id)
-            except GoodsSKU.DoesNotExist:
-                # from django.http import Http404
-                # raise Http404("商品不存在!")
-                return redirect(reverse("goods:index"))
-
-            # 获取类别
-            categorys = GoodsCategory.objects.all()
-
-            # 从订单中获取评论信息
-            sku_orders = sku.ordergoods_set.all().order_by('-create_time')[:30]
-            if sku_orders:
-                for sku_order in sku_orders:
-                    sku_order.ctime = sku_order.create_time.strftime('%Y-%m-%d %H:%M:%S')
-                    sku_order.username = sku_order.order.user.username
-            else:
-                sku_orders = []
+        # 获取类别
+        categorys = GoodsCategory.objects.all()
 
-            # 获取最新推荐
-            new_skus = GoodsSKU.objects.filter(category=sku.category).order_by("-create_time")[:2]
+        # 获取最新推荐
+        new_skus = GoodsSKU.objects.filter(category=sku.category).order_by("-create_time")[:2]
 
-            # 获取其他规格的商品
-            goods_skus = sku.goods.goodssku_set.exclude(id=sku_id)
+        # 获取其他规格的商品
+        goods_skus = sku.goods.goodssku_set.exclude(id=sku_id)
 
-            context = {
-                "categorys": categorys,
-                "sku": sku,
-                "orders": sku_orders,
-                "new_skus": new_skus,
-                "goods_skus": goods_skus
-            }
+        context = {
+            "categorys": categorys,
+            "sku": sku,
+            "new_skus": new_skus,
+            "goods_skus": goods_skus
+        }
+        return context
 
-            # 设置缓存
-            cache.set("detail_%s" % sku_id, context, 3600)
+    def get_snapshot(self, sku_id):
+        """商品详情页面数据的快照，用于保存到缓存中"""
+        context = self.get_context(sku_id)
+        if context is None:
+            return None
+        return snapshot_detail(context)
+
+    def get(self, request, sku_id):
+        """提供页面"""
+        # 尝试获取缓存数据, 如果缓存不存在，只由一个进程查询数据库并设置缓存
+        context = get_or_compute("detail_%s" % sku_id, lambda: self.get_snapshot(sku_id), 3600,
+                                 get_tags=get_detail_tags, encode=encode_snapshot, decode=decode_snapshot)
+        if context is None:
+            # 商品不存在
+            # from django.http import Http404, JsonResponse
+            # raise Http404("商品不存在!")
+            return redirect(reverse("goods:index"))
 
         # 购物车数量
         cart_num = self.get_cart_num(request)
 
         # 浏览记录
         if request.user.is_authenticated():
-            user_id = request.user.id
-            redis_conn = get_redis_connection("default")
-            # 移除已经存在的本商品浏览记录
-            redis_conn.lrem("history_%s" % user_id, 0, sku_id)
-            # 添加新的浏览记录
-            redis_conn.lpush("history_%s" % user_id, sku_id)
-            # 只保存最多5条记录
-            redis_conn.ltrim("history_%s" % user_id, 0, 4)
+            record_history(request.user.id, sku_id)
+
+        # 评论信息，使用单独的缓存，有新评论时只清除评论的缓存
+        reviews = get_reviews(sku_id)
 
-        context.update({"cart_num": cart_num})
+        context.update({"cart_num": cart_num, "orders": reviews["reviews"], "reviews_next": reviews["next"]})
 
         return render(request, 'detail.html', context)
 
 
+class ReviewsView(View):
+    """商品评论, 供页面加载更多评论使用"""
+    def get(self, request, sku_id):
+        # 上一页返回的游标
+        cursor = request.GET.get("cursor")
+        try:
+            reviews = query_reviews(sku_id, cursor)
+        except ValueError:
+            return JsonResponse({"code": 1, "message": "参数错误"})
+
+        return JsonResponse({"code": 0, "message": "OK", "reviews": reviews["reviews"], "next": reviews["next"]})
+
+
 class ListView(BaseCartView):
     """商品列表页"""
+    # 查询数据库时每种排序方式使用的排序字段，最后是id，用来生成游标
+    orderings = {
+        "default": ("id",),
+        "price": ("price", "id"),
+        "hot": ("-sales", "-id"),
+    }
+
+    def get_page(self, paginator, page, cursor=None):
+        """获取一页数据，页数不存在时返回第一页"""
+        try:
+            if cursor is not None:
+                return paginator.page(page, cursor)
+            return paginator.page(page)
+        except EmptyPage:
+            # 表示用户请求的页数不存在相应的数据, 返回第一页的数据
+            return paginator.page(1)
+
+    def get_rankings_page(self, category, sort, page):
+        """从redis的排序索引中按照页数取出商品id，只查询当前页的商品"""
+        # 分类的新品推荐
+        new_skus = RankedSKUs(category.id, "new")[:2]
+        paginator = Paginator(RankedSKUs(category.id, sort), settings.GOODS_LIST_PAGE_SIZE)
+        return new_skus, paginator, self.get_page(paginator, page)
+
+    def get_db_page(self, category, sort, page, cursor):
+        """查询数据库，使用缓存的商品数目和游标分页"""
+        skus = GoodsSKU.objects.filter(category=category, status=True)
+        # 分类的新品推荐
+        new_skus = skus.order_by("-create_time")[:2]
+        paginator = KeysetPaginator(skus, settings.GOODS_LIST_PAGE_SIZE, get_category_count(category.id),
+                                    self.orderings[sort])
+        return new_skus, paginator, self.get_page(paginator, page, cursor or "")
+
     def get(self, request, category_id, page):
         """category_id 是商品分类id， page是页数"""
         # 分析在视图中需要用到哪些参数
@@ -177,29 +198,20 @@ class ListView(BaseCartView):
         # 分类信息
         categorys = GoodsCategory.objects.all()
 
-        # 分类的新品推荐
-        new_skus = GoodsSKU.objects.filter(category=category).order_by("-create_time")[:2]
-
-        # 分类的商品数据
-        if sort == "price":
-            skus = GoodsSKU.objects.filter(category=category).order_by("price")
-        elif sort == "hot":
-            skus = GoodsSKU.objects.filter(category=category).order_by("-sales")
-        else:
-            skus = GoodsSKU.objects.filter(category=category)
-
-        # 分页处理
-        # 创建分页器
-        # paginator(要分页的数据， 每页的数据数目
-        paginator = Paginator(skus, 1)
+        # 分类的商品数据和分页处理
         # page传进来的时候是字符串，需要转换成整数传给分页器
         page = int(page)
-        try:
-            page_skus = paginator.page(page)
-        except EmptyPage:
-            # 表示用户请求的页数不存在相应的数据, 返回第一页的数据
-            page_skus = paginator.page(1)
-            page = 1
+        # 查询数据库时，上一页返回的游标
+        cursor = request.GET.get("cursor")
+        if settings.GOODS_LIST_USE_RANKINGS:
+            try:
+                new_skus, paginator, page_skus = self.get_rankings_page(category, sort, page)
+            except RedisError:
+                # redis不可用时查询数据库
+                new_skus, paginator, page_skus = self.get_db_page(category, sort, page, cursor)
+        else:
+            new_skus, paginator, page_skus = self.get_db_page(category, sort, page, cursor)
+        page = page_skus.number
 
         num_pages = paginator.num_pages
         # 页面展示的页数
@@ -0,0 +1,148 @@
+from django.conf import settings
+from django.db import transaction, OperationalError
+from django.db.models import F
+from goods.models import GoodsSKU
+from goods.utils import get_skus
+from goods import inventory
+from goods import popularity
+from orders.models import OrderInfo, OrderGoods
+from orders.utils import clear_order_count
+from utils.snowflake import next_order_id
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+# 可以重试的mysql错误 1205 锁等待超时  1213 死锁
+RETRY_ERROR_CODES = (1205, 1213)
+
+
+class OrderCommitError(Exception):
+    """保存订单失败，code和message返回给前端"""
+    def __init__(self, code, message):
+        super(OrderCommitError, self).__init__(message)
+        self.code = code
+        self.message = message
+
+
+def _backoff(attempt):
+    """第attempt次重试之前等待的时间，指数增长并加上随机抖动"""
+    policy = settings.ORDER_COMMIT_RETRY
+    delay = min(policy["BACKOFF"] * (2 ** attempt), policy["MAX_BACKOFF"])
+    return delay * random.uniform(0.5, 1)
+
+
+def _save_order(user, address, pay_method, skus, counts, reserved=False, order_id=None):
+    """保存订单数据， 需要在事务中执行, reserved表示库存已经在redis中预占了"""
+    # 订单编号按照时间递增，同一用户同一秒内的多个订单也不会重复
+    # 提前生成的订单编号同时是幂等键，重复保存时插入订单的主键冲突，整个事务回滚
+    order_id = order_id or next_order_id()
+
+    order = OrderInfo.objects.create(
+        order_id=order_id,
+        user=user,
+        address=address,
+        total_amount=0,
+        trans_cost=10,  # 运费暂时写死
+        pay_method=pay_method
+    )
+
+    total_count = 0
+    total_amount = 0
+    order_goods = []
+    # skus按照id排序，所有订单按照相同的顺序锁定商品的数据行，避免死锁
+    for sku in skus:
+        count = counts[sku.id]
+        if not reserved:
+            # 库存足够时直接在数据库中减少库存，增加销量
+            # update goods_sku set stock=stock-count, sales=sales+count where id=sku_id and stock>=count
+            result = GoodsSKU.objects.filter(id=sku.id, stock__gte=count).update(
+                stock=F("stock") - count, sales=F("sales") + count)
+            if result == 0:
+                raise OrderCommitError(5, "库存不足")
+
+        order_goods.append(OrderGoods(order=order, sku=sku, count=count, price=sku.price))
+
+        # 计算订单的总金额和商品的总数量
+        total_amount += sku.price * count
+        total_count += count
+
+    # 一次性保存订单商品表的数据
+    OrderGoods.objects.bulk_create(order_goods)
+
+    # 更新订单信息表数据，处理总金额总数量
+    order.total_amount = total_amount + 10
+    order.total_count = total_count
+    order.save(update_fields=["total_amount", "total_count"])
+    return order
+
+
+def get_order_counts(sku_ids, cart):
+    """从购物车中获取用户订购的商品的数量
+
+    :param sku_ids: 要下单的商品id列表
+    :param cart: 用户的购物车数据 {b"sku_id": b"count"}
+    :return: {sku_id: count}
+    """
+    counts = {}
+    for sku_id in sku_ids:
+        count = cart.get(str(sku_id).encode())
+        if count is None:
+            raise OrderCommitError(4, "商品信息有误")
+        counts[int(sku_id)] = int(count)
+    return counts
+
+
+def create_order(user, address, pay_method, counts, order_id=None):
+    """创建订单，失败时抛出OrderCommitError
+
+    :param user: 下单用户
+    :param address: 收货地址
+    :param pay_method: 支付方式
+    :param counts: 要下单的商品和数量 {sku_id: count}
+    :param order_id: 提前生成的订单编号，订单已经存在时抛出IntegrityError，不会重复扣减库存
+    :return: 订单对象
+    """
+    # 商品按照id排序
+    sku_ids = sorted(counts.keys())
+    skus, missing_ids = get_skus(sku_ids)
+    if missing_ids:
+        raise OrderCommitError(4, "商品信息有误")
+
+    # 抢购模式下先在redis中预占库存，mysql中的库存和销量由celery任务批量同步，下单时不再更新商品表
+    reserved = inventory.is_enabled()
+    if reserved and inventory.reserve(counts) is not None:
+        raise OrderCommitError(5, "库存不足")
+
+    try:
+        order = _commit(user, address, pay_method, skus, counts, reserved, order_id)
+    except Exception:
+        if reserved:
+            # 订单没有保存成功，释放预占的库存
+            inventory.release(counts)
+        raise
+
+    # 订单已经保存，之后的操作失败时只记录日志，不影响下单的结果
+    try:
+        # 用户的订单数目变化了
+        clear_order_count(user.id)
+        # 记录商品的人气
+        popularity.record([(sku.category_id, sku.id, counts[sku.id]) for sku in skus])
+    except Exception:
+        logger.exception("order %s committed, but updating the order count or popularity failed", order.order_id)
+    return order
+
+
+def _commit(user, address, pay_method, skus, counts, reserved, order_id=None):
+    """按照重试策略在事务中保存订单"""
+    times = settings.ORDER_COMMIT_RETRY["TIMES"]
+    for attempt in range(times):
+        try:
+            # 每次尝试都是一个完整的事务，出现死锁时mysql会回滚整个事务
+            with transaction.atomic():
+                return _save_order(user, address, pay_method, skus, counts, reserved, order_id)
+        except OperationalError as e:
+            if e.args[0] not in RETRY_ERROR_CODES or attempt == times - 1:
+                raise OrderCommitError(6, "下单失败")
+            time.sleep(_backoff(attempt))
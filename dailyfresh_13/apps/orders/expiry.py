@@ -0,0 +1,136 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, Case, When, Value, IntegerField
+from django.utils import timezone
+from goods.models import GoodsSKU
+from goods import inventory
+from goods import popularity
+from orders.models import OrderInfo, OrderGoods
+from orders.payment import settle_orders
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _count_case(counts):
+    """case id when sku_id then count ... else 0 end"""
+    return Case(*[When(id=sku_id, then=Value(count)) for sku_id, count in counts.items()],
+                default=Value(0), output_field=IntegerField())
+
+
+def _find_expired(deadline, batch_size, last=None):
+    """按照(create_time, order_id)的顺序查找一批超时未支付的订单，last是上一批最后一个订单的(create_time, order_id)
+
+    :return: [(订单编号, 支付方式, 订单金额, 下单时间)]
+    """
+    # 使用(status, create_time)索引查找超时的订单
+    orders = OrderInfo.objects.using("default").filter(
+        status=OrderInfo.ORDER_STATUS_ENUM["UNPAID"], create_time__lt=deadline)
+    if last is not None:
+        orders = orders.filter(Q(create_time__gt=last[0]) | Q(create_time=last[0], order_id__gt=last[1]))
+    return list(orders.order_by("create_time", "order_id").values_list(
+        "order_id", "pay_method", "total_amount", "create_time")[:batch_size])
+
+
+def _cancel_batch(order_ids):
+    """在一个事务中取消一批订单
+
+    :return: (取消的订单数, 订单中的商品 {sku_id: count}, 订单中的销量 [(分类id, 商品id, 数量, 下单时间)])
+    """
+    unpaid = OrderInfo.ORDER_STATUS_ENUM["UNPAID"]
+    with transaction.atomic():
+        # 锁定仍然是待支付状态的订单，其他任务或支付通知会等待这批订单处理完
+        # celery任务中的读操作会被路由到从数据库，事务中的查询都指定主数据库
+        order_ids = list(OrderInfo.objects.using("default").select_for_update().filter(
+            order_id__in=order_ids, status=unpaid).values_list("order_id", flat=True))
+        if not order_ids:
+            return 0, {}, []
+
+        sales = list(OrderGoods.objects.using("default").filter(order_id__in=order_ids).values_list(
+            "sku__category_id", "sku_id", "count", "order__create_time"))
+        counts = {}
+        for _, sku_id, count, _ in sales:
+            counts[sku_id] = counts.get(sku_id, 0) + count
+
+        # 只修改仍然是待支付状态的订单，重复执行不会重复恢复库存
+        canceled = OrderInfo.objects.filter(order_id__in=order_ids, status=unpaid).update(
+            status=OrderInfo.ORDER_STATUS_ENUM["CANCELED"])
+
+        if counts and not inventory.is_enabled():
+            # 一条update语句恢复所有商品的库存和销量
+            # update df_goods_sku set stock=stock+case ... end, sales=sales-case ... end where id in (...)
+            GoodsSKU.objects.filter(id__in=sorted(counts.keys())).update(
+                stock=F("stock") + _count_case(counts), sales=F("sales") - _count_case(counts))
+    return canceled, counts, sales
+
+
+def _cancel_orders(order_ids, result):
+    """取消订单并释放预占的库存，记录锁定的时间，返回取消的订单数"""
+    lock_start = time.time()
+    canceled, counts, sales = _cancel_batch(order_ids)
+    lock_seconds = time.time() - lock_start
+
+    if counts and inventory.is_enabled():
+        # 抢购模式下库存在redis中，释放预占的库存，由同步任务恢复mysql中的库存和销量
+        inventory.release(counts)
+
+    try:
+        # 减去下单时记录的商品人气，不支付的订单不会提高商品的排名
+        popularity.cancel(sales)
+    except Exception:
+        logger.exception("canceled %d orders, but updating the popularity failed", canceled)
+
+    result["batches"] += 1
+    result["lock_seconds"] += lock_seconds
+    result["max_lock_seconds"] = max(result["max_lock_seconds"], lock_seconds)
+    return canceled
+
+
+def cancel_expired_orders(timeout=None, batch_size=None):
+    """分批取消超时未支付的订单，恢复商品的库存和销量
+
+    支付宝的订单先向支付宝查询交易，已经支付（没有收到通知）的订单设置为支付成功，
+    只取消确认没有支付的订单，查询失败的订单留到下次再处理
+
+    :param timeout: 订单超过多少秒未支付时取消
+    :param batch_size: 每个事务取消的订单数目
+    :return: {"orders": 取消的订单数, "paid": 查询到已经支付的订单数, "skipped": 查询失败没有取消的订单数,
+              "batches": 事务数, "max_lock_seconds": 单个事务最长的时间, "lock_seconds": 所有事务的时间, "seconds": 总耗时}
+    """
+    timeout = timeout or settings.ORDER_UNPAID_TIMEOUT
+    batch_size = batch_size or settings.ORDER_EXPIRE_BATCH
+    deadline = timezone.now() - timedelta(seconds=timeout)
+    alipay = OrderInfo.PAY_METHODS_ENUM["ALIPAY"]
+
+    start = time.time()
+    result = {"orders": 0, "paid": 0, "skipped": 0, "batches": 0, "max_lock_seconds": 0, "lock_seconds": 0}
+    last = None
+    with ThreadPoolExecutor(max_workers=settings.ALIPAY_SETTLE_WORKERS) as executor:
+        while True:
+            expired = _find_expired(deadline, batch_size, last)
+            if not expired:
+                break
+            # 查询失败的订单仍然是待支付状态，从这一批之后继续查找，不会重复处理
+            last = (expired[-1][3], expired[-1][0])
+
+            order_ids = [order_id for order_id, pay_method, _, _ in expired if pay_method != alipay]
+            alipay_orders = [(order_id, total_amount) for order_id, pay_method, total_amount, _ in expired
+                             if pay_method == alipay]
+            if alipay_orders:
+                paid, unpaid = settle_orders(alipay_orders, executor)
+                result["paid"] += paid
+                result["skipped"] += len(alipay_orders) - paid - len(unpaid)
+                order_ids.extend(unpaid)
+
+            if order_ids:
+                result["orders"] += _cancel_orders(order_ids, result)
+            if len(expired) < batch_size:
+                break
+
+    result["seconds"] = round(time.time() - start, 3)
+    result["lock_seconds"] = round(result["lock_seconds"], 3)
+    result["max_lock_seconds"] = round(result["max_lock_seconds"], 3)
+    return result
@@ -0,0 +1,54 @@
+from urllib.parse import urlencode
+import uuid
+
+# 本地测试使用的支付宝替身，接口与alipay.AliPay相同，不访问网络
+# settings.ALIPAY_CLIENT_CLASS = "orders.fake_alipay.FakeAliPay"
+
+# 替身使用的签名
+FAKE_SIGN = "fake-sign"
+
+
+class FakeAliPay(object):
+    """支付宝替身"""
+    # 支付宝中的交易 {out_trade_no: {"trade_no": 支付宝交易号, "trade_status": 交易状态, "total_amount": 金额}}
+    trades = {}
+
+    def __init__(self, appid, app_notify_url=None, **kwargs):
+        self.appid = appid
+        self.app_notify_url = app_notify_url
+
+    def api_alipay_trade_page_pay(self, subject, out_trade_no, total_amount, return_url=None, notify_url=None, **kwargs):
+        """发起支付，返回跳转到支付宝的参数"""
+        self.trades[out_trade_no] = {
+            "trade_no": uuid.uuid4().hex,
+            "trade_status": "WAIT_BUYER_PAY",
+            "total_amount": total_amount,
+        }
+        return urlencode({"out_trade_no": out_trade_no, "total_amount": total_amount, "subject": subject})
+
+    def api_alipay_trade_query(self, out_trade_no=None, trade_no=None):
+        """查询交易状态"""
+        trade = self.trades.get(out_trade_no)
+        if trade is None:
+            return {"code": "40004", "msg": "Business Failed", "sub_code": "ACQ.TRADE_NOT_EXIST"}
+        return {"code": "10000", "msg": "Success", "out_trade_no": out_trade_no,
+                "trade_no": trade["trade_no"], "trade_status": trade["trade_status"],
+                "total_amount": trade["total_amount"]}
+
+    def verify(self, data, signature):
+        """验证支付宝通知的签名"""
+        return signature == FAKE_SIGN
+
+    def pay(self, out_trade_no):
+        """模拟用户支付成功，返回支付宝异步通知的参数"""
+        trade = self.trades[out_trade_no]
+        trade["trade_status"] = "TRADE_SUCCESS"
+        return {
+            "app_id": self.appid,
+            "out_trade_no": out_trade_no,
+            "trade_no": trade["trade_no"],
+            "trade_status": trade["trade_status"],
+            "total_amount": trade["total_amount"],
+            "sign_type": "RSA2",
+            "sign": FAKE_SIGN,
+        }
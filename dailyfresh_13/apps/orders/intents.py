@@ -0,0 +1,188 @@
+from django.conf import settings
+from django.db import IntegrityError
+from django_redis import get_redis_connection
+from users.models import User, Address
+from orders.models import OrderInfo
+from orders.commit import create_order, OrderCommitError
+from cart.utils import RedisCart
+from utils.snowflake import next_order_id
+import json
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# 异步下单时，下单请求（订单意向）保存在redis的列表中，由celery任务批量创建订单，
+# 前端使用返回的编号查询下单结果
+# 下单的商品在保存订单意向之前已经从购物车中取出，下单失败时放回购物车；
+# 订单编号在保存订单意向时生成，重复处理同一个订单意向时不会创建第二个订单
+
+# 等待处理的订单意向
+ORDER_INTENT_QUEUE = "order_intents"
+# 正在处理的订单意向，保存下单结果之后才删除，处理的进程中途退出时由celery任务放回等待队列
+ORDER_INTENT_PROCESSING = "order_intents_processing"
+# 订单意向开始处理的时间 {订单意向: 时间戳}
+ORDER_INTENT_TAKEN = "order_intents_taken"
+# 下单结果 {"status": "pending" | "success" | "failed", ...}
+ORDER_TICKET_KEY = "order_ticket_%s"
+# 下单结果的保存时间
+ORDER_TICKET_TIMEOUT = 24 * 3600
+
+STATUS_PENDING = "pending"
+STATUS_SUCCESS = "success"
+STATUS_FAILED = "failed"
+
+
+# 从等待队列的头部取出订单意向放到正在处理的列表中 KEYS: 等待队列, 正在处理, 开始处理的时间  ARGV: 数目, 现在
+TAKE = """
+local intents = redis.call("LRANGE", KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #intents > 0 then
+    redis.call("LTRIM", KEYS[1], #intents, -1)
+    for _, intent in ipairs(intents) do
+        redis.call("RPUSH", KEYS[2], intent)
+        redis.call("HSET", KEYS[3], intent, ARGV[2])
+    end
+end
+return intents
+"""
+
+# 处理超时的订单意向放回等待队列的头部 KEYS 同TAKE  ARGV: 在这个时间之前开始处理的认为已经超时
+REQUEUE = """
+local count = 0
+for _, intent in ipairs(redis.call("LRANGE", KEYS[2], 0, -1)) do
+    local taken = redis.call("HGET", KEYS[3], intent)
+    if not taken or tonumber(taken) < tonumber(ARGV[1]) then
+        redis.call("LREM", KEYS[2], 1, intent)
+        redis.call("HDEL", KEYS[3], intent)
+        redis.call("LPUSH", KEYS[1], intent)
+        count = count + 1
+    end
+end
+return count
+"""
+
+_scripts = {}
+
+_KEYS = [ORDER_INTENT_QUEUE, ORDER_INTENT_PROCESSING, ORDER_INTENT_TAKEN]
+
+
+def _run(redis_conn, script, keys, args):
+    if script not in _scripts:
+        _scripts[script] = redis_conn.register_script(script)
+    return _scripts[script](keys=keys, args=args, client=redis_conn)
+
+
+def is_enabled():
+    """是否开启了异步下单"""
+    return getattr(settings, "ORDER_COMMIT_ASYNC", False)
+
+
+def _set_ticket(redis_conn, ticket, data):
+    redis_conn.setex(ORDER_TICKET_KEY % ticket, ORDER_TICKET_TIMEOUT, json.dumps(data))
+
+
+def enqueue(user_id, address_id, pay_method, counts):
+    """保存订单意向，返回查询下单结果的编号
+
+    :param counts: 要下单的商品和数量 {sku_id: count}，已经从购物车中取出
+    """
+    redis_conn = get_redis_connection("default")
+    ticket = uuid.uuid4().hex
+    intent = {
+        "ticket": ticket,
+        "order_id": next_order_id(),
+        "user_id": user_id,
+        "address_id": address_id,
+        "pay_method": pay_method,
+        "counts": [[sku_id, count] for sku_id, count in counts.items()],
+    }
+    pipe = redis_conn.pipeline()
+    _set_ticket(pipe, ticket, {"status": STATUS_PENDING, "user_id": user_id})
+    pipe.rpush(ORDER_INTENT_QUEUE, json.dumps(intent))
+    pipe.execute()
+    return ticket
+
+
+def get_ticket(ticket):
+    """查询下单结果，编号不存在时返回None"""
+    redis_conn = get_redis_connection("default")
+    data = redis_conn.get(ORDER_TICKET_KEY % ticket)
+    if data is None:
+        return None
+    return json.loads(data.decode())
+
+
+def _take_intents(redis_conn, batch_size):
+    """一次取出最多batch_size个订单意向，返回原始的数据，处理完之后需要调用_done删除"""
+    return _run(redis_conn, TAKE, _KEYS, [batch_size, time.time()])
+
+
+def _done(redis_conn, raw):
+    """订单意向处理完成，从正在处理的列表中删除"""
+    pipe = redis_conn.pipeline()
+    pipe.lrem(ORDER_INTENT_PROCESSING, 1, raw)
+    pipe.hdel(ORDER_INTENT_TAKEN, raw)
+    pipe.execute()
+
+
+def requeue_stale(timeout=None, redis_conn=None):
+    """将处理超时（处理的进程中途退出）的订单意向放回等待队列，返回放回的数目"""
+    redis_conn = redis_conn or get_redis_connection("default")
+    timeout = timeout or settings.ORDER_INTENT_TIMEOUT
+    return _run(redis_conn, REQUEUE, _KEYS, [time.time() - timeout])
+
+
+def _fail_intent(redis_conn, intent, counts, code, message):
+    """下单失败，保存下单结果，把商品放回购物车"""
+    _set_ticket(redis_conn, intent["ticket"], {"status": STATUS_FAILED, "user_id": intent["user_id"], "code": code,
+                                               "message": message})
+    RedisCart(intent["user_id"], redis_conn).merge(counts)
+
+
+def _commit_intent(redis_conn, intent):
+    """为一个订单意向创建订单，保存下单结果"""
+    ticket = intent["ticket"]
+    user_id = intent["user_id"]
+    order_id = intent.get("order_id")
+    counts = {sku_id: count for sku_id, count in intent["counts"]}
+    data = redis_conn.get(ORDER_TICKET_KEY % ticket)
+    if data is not None and json.loads(data.decode())["status"] != STATUS_PENDING:
+        # 放回等待队列之前已经保存了下单结果，不再重复下单
+        return False
+    try:
+        if order_id is not None and OrderInfo.objects.using("default").filter(order_id=order_id).exists():
+            # 订单已经创建，但是处理的进程在保存下单结果之前退出了
+            order = OrderInfo(order_id=order_id)
+        else:
+            user = User.objects.get(id=user_id)
+            address = Address.objects.get(id=intent["address_id"], user=user)
+            order = create_order(user, address, intent["pay_method"], counts, order_id)
+    except OrderCommitError as e:
+        _fail_intent(redis_conn, intent, counts, e.code, e.message)
+        return False
+    except IntegrityError:
+        if not OrderInfo.objects.using("default").filter(order_id=order_id).exists():
+            logger.exception("订单意向%s下单失败", ticket)
+            _fail_intent(redis_conn, intent, counts, 7, "下单失败")
+            return False
+        # 超时放回等待队列的订单意向，和原来的进程同时在处理，订单已经由原来的进程创建
+        order = OrderInfo(order_id=order_id)
+    except Exception:
+        logger.exception("订单意向%s下单失败", ticket)
+        _fail_intent(redis_conn, intent, counts, 7, "下单失败")
+        return False
+
+    _set_ticket(redis_conn, ticket, {"status": STATUS_SUCCESS, "user_id": user_id, "order_id": order.order_id})
+    return True
+
+
+def process_intents(batch_size=None):
+    """批量处理订单意向，每个订单使用单独的事务， 返回处理的订单意向数目"""
+    redis_conn = get_redis_connection("default")
+    batch_size = batch_size or settings.ORDER_COMMIT_BATCH
+    intents = _take_intents(redis_conn, batch_size)
+    for raw in intents:
+        _commit_intent(redis_conn, json.loads(raw.decode()))
+        _done(redis_conn, raw)
+    return len(intents)
@@ -29,6 +29,7 @@ class OrderInfo(BaseModel):
         3: "待收货",
         4: "待评价",
         5: "已完成",
+        6: "已取消",
     }
 
     ORDER_STATUS_ENUM = {
@@ -36,7 +37,8 @@ class OrderInfo(BaseModel):
         "UNSEND": 2,
         "UNRECEIVED": 3,
         "UNCOMMENT": 4,
-        "FINISHED": 5
+        "FINISHED": 5,
+        "CANCELED": 6
     }
 
     ORDER_STATUS_CHOICES = (
@@ -45,6 +47,7 @@ class OrderInfo(BaseModel):
         (3, "待收货"),
         (4, "待评价"),
         (5, "已完成"),
+        (6, "已取消"),
     )
 
     order_id = models.CharField(max_length=64, primary_key=True, verbose_name="订单号")
@@ -59,6 +62,8 @@ class OrderInfo(BaseModel):
 
     class Meta:
         db_table = "df_order_info"
+        # 按照状态和下单时间查询超时未支付的订单
+        index_together = [["status", "create_time"]]
 
 
 class OrderGoods(BaseModel):
@@ -0,0 +1,236 @@
+from django.conf import settings
+from django.db.models import Case, When, Value, CharField
+from django.utils.module_loading import import_string
+from django_redis import get_redis_connection
+from orders.models import OrderInfo
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 订单支付成功的标记，查询支付结果时先读取这个标记
+PAY_STATUS_KEY = "pay_status_%s"
+PAY_STATUS_TIMEOUT = 3600
+
+# 表示支付成功的交易状态
+TRADE_SUCCESS_STATUS = ("TRADE_SUCCESS", "TRADE_FINISHED")
+# 表示没有支付的交易状态
+TRADE_UNPAID_STATUS = ("WAIT_BUYER_PAY", "TRADE_CLOSED")
+
+# 向支付宝查询交易的结果
+TRADE_PAID = "paid"  # 已经支付
+TRADE_UNPAID = "unpaid"  # 确认没有支付
+TRADE_UNKNOWN = "unknown"  # 查询失败或结果异常，不能确定
+
+# 表示已经支付的订单状态
+PAID_ORDER_STATUS = (
+    OrderInfo.ORDER_STATUS_ENUM["UNSEND"],
+    OrderInfo.ORDER_STATUS_ENUM["UNRECEIVED"],
+    OrderInfo.ORDER_STATUS_ENUM["UNCOMMENT"],
+    OrderInfo.ORDER_STATUS_ENUM["FINISHED"],
+)
+
+# 进程内共享的alipay支付工具对象 {工具类: 对象}
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def new_alipay_client():
+    """构建alipay支付工具对象"""
+    client_class = import_string(settings.ALIPAY_CLIENT_CLASS)
+    return client_class(
+        appid=settings.ALIPAY_APPID,  # 沙箱模式中的appid
+        app_notify_url=settings.ALIPAY_NOTIFY_URL,  # 支付宝异步通知支付结果的url
+        app_private_key_path=os.path.join(settings.BASE_DIR, "apps/orders/app_private_key.pem"),
+        alipay_public_key_path=os.path.join(settings.BASE_DIR, "apps/orders/alipay_public_key.pem"),  # 支付宝的公钥，验证支付宝回传消息使用，不是你自己的公钥,
+        sign_type="RSA2",  # RSA 或者 RSA2
+        debug=True  # 默认False, 沙箱模式配置为true
+    )
+
+
+def get_alipay_client():
+    """获取进程内共享的alipay支付工具对象，第一次使用时构建，之后不再重复读取和解析密钥文件"""
+    client_class = settings.ALIPAY_CLIENT_CLASS
+    client = _clients.get(client_class)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(client_class)
+            if client is None:
+                client = _clients[client_class] = new_alipay_client()
+    return client
+
+
+def _already_paid(order_ids, trades):
+    """返回其中已经是支付成功状态的订单，已经取消的订单记录错误日志，需要人工退款"""
+    paid = []
+    orders = OrderInfo.objects.using("default").filter(order_id__in=order_ids).values_list("order_id", "status")
+    for order_id, status in orders:
+        if status in PAID_ORDER_STATUS:
+            paid.append(order_id)
+        elif status == OrderInfo.ORDER_STATUS_ENUM["CANCELED"]:
+            logger.error("order %s was paid after it was canceled, alipay trade %s", order_id, trades[order_id])
+    return paid
+
+
+def mark_order_paid(order_id, trade_id):
+    """将待支付的订单设置为支付成功（待评价）, 重复调用不会重复修改，返回订单是否是已经支付的状态
+
+    订单已经取消时不修改，记录错误日志并返回False
+    """
+    result = OrderInfo.objects.filter(order_id=order_id, status=OrderInfo.ORDER_STATUS_ENUM["UNPAID"]).update(
+        status=OrderInfo.ORDER_STATUS_ENUM["UNCOMMENT"],  # 设置订单状态为待评价
+        trade_id=trade_id  # 支付宝的交易标号
+    )
+    if result == 0 and not _already_paid([order_id], {order_id: trade_id}):
+        return False
+    # 在redis中标记支付成功，查询支付结果时不用访问数据库
+    redis_conn = get_redis_connection("default")
+    redis_conn.setex(PAY_STATUS_KEY % order_id, PAY_STATUS_TIMEOUT, trade_id)
+    return True
+
+
+def mark_orders_paid(trades):
+    """批量将待支付的订单设置为支付成功，只执行一条update语句
+
+    :param trades: {order_id: trade_id}
+    :return: 修改的订单数目
+    """
+    if not trades:
+        return 0
+    # update df_order_info set status=4, trade_id=case order_id when ... end where order_id in (...) and status=1
+    trade_id = Case(*[When(order_id=order_id, then=Value(trade_id)) for order_id, trade_id in trades.items()],
+                    output_field=CharField())
+    result = OrderInfo.objects.filter(order_id__in=list(trades.keys()),
+                                      status=OrderInfo.ORDER_STATUS_ENUM["UNPAID"]).update(
+        status=OrderInfo.ORDER_STATUS_ENUM["UNCOMMENT"], trade_id=trade_id)
+
+    # 只标记已经是支付成功状态的订单，已经取消的订单不标记
+    paid = _already_paid(list(trades.keys()), trades) if result < len(trades) else list(trades.keys())
+    if paid:
+        redis_conn = get_redis_connection("default")
+        pipe = redis_conn.pipeline()
+        for order_id in paid:
+            pipe.setex(PAY_STATUS_KEY % order_id, PAY_STATUS_TIMEOUT, trades[order_id])
+        pipe.execute()
+    return result
+
+
+def is_order_paid(order_id):
+    """根据redis中的标记判断订单是否已经支付成功"""
+    redis_conn = get_redis_connection("default")
+    return redis_conn.exists(PAY_STATUS_KEY % order_id)
+
+
+def handle_notify(data):
+    """处理支付宝的异步通知， 返回是否处理成功
+
+    :param data: 支付宝POST的参数字典
+    """
+    data = dict(data)
+    signature = data.pop("sign", None)
+    if not signature or not get_alipay_client().verify(data, signature):
+        return False
+
+    if data.get("trade_status") not in TRADE_SUCCESS_STATUS:
+        # 其他状态的通知不需要处理
+        return True
+
+    order_id = data.get("out_trade_no")
+    try:
+        order = OrderInfo.objects.using("default").get(order_id=order_id)
+    except OrderInfo.DoesNotExist:
+        return False
+    # 核对支付的金额
+    if Decimal(data.get("total_amount", "0")) != order.total_amount:
+        return False
+
+    # 订单已经取消时返回失败，支付宝会继续通知，同时记录了错误日志
+    return mark_order_paid(order_id, data.get("trade_no"))
+
+
+def _query_trade(order):
+    """向支付宝查询订单的交易
+
+    :param order: (订单编号, 订单金额)
+    :return: (TRADE_PAID/TRADE_UNPAID/TRADE_UNKNOWN, 支付成功时支付宝的交易号)
+    """
+    order_id, total_amount = order
+    try:
+        response = get_alipay_client().api_alipay_trade_query(order_id)
+    except Exception:
+        # 网络错误等，下次再查询
+        return TRADE_UNKNOWN, None
+    code = response.get("code")
+    if code == "40004":
+        # 支付宝中没有这个交易，用户没有打开过支付页面
+        return TRADE_UNPAID, None
+    if code != "10000":
+        return TRADE_UNKNOWN, None
+
+    trade_status = response.get("trade_status")
+    if trade_status in TRADE_UNPAID_STATUS:
+        return TRADE_UNPAID, None
+    if trade_status not in TRADE_SUCCESS_STATUS:
+        return TRADE_UNKNOWN, None
+    if "total_amount" in response and Decimal(response["total_amount"]) != total_amount:
+        # 金额不一致需要人工处理
+        return TRADE_UNKNOWN, None
+    return TRADE_PAID, response.get("trade_no")
+
+
+def settle_orders(orders, executor):
+    """向支付宝查询一批订单的交易，批量更新已经支付的订单
+
+    :param orders: [(订单编号, 订单金额)]
+    :param executor: 查询使用的线程池
+    :return: (更新的订单数, 确认没有支付的订单编号列表)
+    """
+    results = executor.map(_query_trade, orders)
+    trades = {}
+    unpaid = []
+    for (order_id, _), (status, trade_id) in zip(orders, results):
+        if status == TRADE_PAID:
+            trades[order_id] = trade_id
+        elif status == TRADE_UNPAID:
+            unpaid.append(order_id)
+    return mark_orders_paid(trades), unpaid
+
+
+def settle_unpaid_orders(batch_size=None, workers=None):
+    """分批查询待支付的支付宝订单的交易状态，批量更新已经支付的订单
+
+    用户支付之后关闭了页面，并且没有收到支付宝的通知时，订单由这里设置为支付成功
+
+    :param batch_size: 每批查询的订单数目
+    :param workers: 同时向支付宝查询的线程数
+    :return: {"checked": 查询的订单数, "paid": 更新的订单数, "seconds": 耗时, "rate": 每秒查询的订单数}
+    """
+    batch_size = batch_size or settings.ALIPAY_SETTLE_BATCH
+    workers = workers or settings.ALIPAY_SETTLE_WORKERS
+    start = time.time()
+    checked = paid = 0
+
+    orders = OrderInfo.objects.filter(status=OrderInfo.ORDER_STATUS_ENUM["UNPAID"],
+                                      pay_method=OrderInfo.PAY_METHODS_ENUM["ALIPAY"]).order_by("order_id")
+    last_order_id = ""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            # 按照订单编号分页，不使用offset，避免越往后查询越慢
+            batch = list(orders.filter(order_id__gt=last_order_id).values_list(
+                "order_id", "total_amount")[:batch_size])
+            if not batch:
+                break
+            last_order_id = batch[-1][0]
+
+            paid += settle_orders(batch, executor)[0]
+            checked += len(batch)
+            if len(batch) < batch_size:
+                break
+
+    seconds = time.time() - start
+    return {"checked": checked, "paid": paid, "seconds": round(seconds, 3),
+            "rate": round(checked / seconds, 1) if seconds else 0}
@@ -1,3 +1,129 @@
-from django.test import TestCase
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, override_settings
+from multiprocessing import Pool, Queue
+from unittest import mock
+import os
+import sys
+import types
+from utils.snowflake import SnowflakeIdGenerator, RedisWorkerLease, next_order_id
+from utils import snowflake
+from orders.fake_alipay import FakeAliPay
+from orders.payment import new_alipay_client, get_alipay_client, handle_notify
 
 # Create your tests here.
+
+
+class _FakeRedis(object):
+    """只实现RedisWorkerLease用到的命令，不处理过期"""
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value.encode()
+        return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def expire(self, key, timeout):
+        return key in self.data
+
+
+def _start_uwsgi_worker(base, worker_ids):
+    """在子进程中模拟一个uwsgi实例的worker：实例的起始编号来自环境变量，worker编号从1开始"""
+    os.environ.pop(snowflake.WORKER_ID_ENV, None)
+    os.environ[snowflake.WORKER_BASE_ENV] = str(base)
+    uwsgi = types.ModuleType("uwsgi")
+    worker_id = worker_ids.get()
+    uwsgi.worker_id = lambda: worker_id
+    sys.modules["uwsgi"] = uwsgi
+
+
+def _generate_order_ids(count):
+    """在子进程中生成订单编号"""
+    return [next_order_id() for _ in range(count)]
+
+
+class SnowflakeIdGeneratorTest(SimpleTestCase):
+    """订单编号生成器"""
+    def test_ids_are_unique_and_ordered(self):
+        generator = SnowflakeIdGenerator(worker_id=1)
+        ids = [generator.next_id() for _ in range(100000)]
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(ids, sorted(ids))
+
+    def test_invalid_worker_id(self):
+        with self.assertRaises(ValueError):
+            SnowflakeIdGenerator(worker_id=1024)
+
+    def test_duplicate_worker_id_rejected(self):
+        # 同一毫秒内两个相同编号的生成器会生成相同的id，第二个生成器占用编号时报错
+        redis_conn = _FakeRedis()
+        generator = SnowflakeIdGenerator(worker_id=2, lease=RedisWorkerLease(redis_conn, 60))
+        generator.next_id()
+        with self.assertRaises(ImproperlyConfigured):
+            SnowflakeIdGenerator(worker_id=2, lease=RedisWorkerLease(redis_conn, 60)).next_id()
+        # 自己占用的编号可以续期
+        self.assertEqual(RedisWorkerLease(redis_conn, 60).claim(2, generator._owner), 20)
+
+    @override_settings(DEBUG=False)
+    def test_worker_id_required_in_production(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop(snowflake.WORKER_ID_ENV, None)
+            os.environ.pop(snowflake.WORKER_BASE_ENV, None)
+            with self.assertRaises(ImproperlyConfigured):
+                SnowflakeIdGenerator().next_id()
+
+    @override_settings(SNOWFLAKE_WORKER_LEASE=0)
+    def test_order_ids_are_unique_across_uwsgi_instances(self):
+        # 同一台主机上两个uwsgi实例（见uwsgi.ini和uwsgi2.ini）各有4个worker同时生成订单编号
+        pools = []
+        for base in (0, 8):
+            worker_ids = Queue()
+            for worker_id in range(1, 5):
+                worker_ids.put(worker_id)
+            pools.append(Pool(4, initializer=_start_uwsgi_worker, initargs=(base, worker_ids)))
+        try:
+            pending = [pool.map_async(_generate_order_ids, [20000] * 4) for pool in pools]
+            results = [result for async_result in pending for result in async_result.get()]
+        finally:
+            for pool in pools:
+                pool.terminate()
+
+        order_ids = [order_id for result in results for order_id in result]
+        self.assertEqual(len(set(order_ids)), len(order_ids))
+        for result in results:
+            # 同一个进程内生成的订单编号按照时间递增，字符串的顺序也是递增的
+            self.assertEqual(result, sorted(result))
+            self.assertTrue(all(len(order_id) == 19 for order_id in result))
+
+
+@override_settings(ALIPAY_CLIENT_CLASS="orders.fake_alipay.FakeAliPay")
+class AlipayNotifyTest(SimpleTestCase):
+    """支付宝替身和异步通知"""
+    def test_fake_alipay_trade(self):
+        alipay = new_alipay_client()
+        self.assertIsInstance(alipay, FakeAliPay)
+        self.assertEqual(alipay.api_alipay_trade_query("404")["code"], "40004")
+
+        alipay.api_alipay_trade_page_pay(subject="test", out_trade_no="1", total_amount="20.00")
+        self.assertEqual(alipay.api_alipay_trade_query("1")["trade_status"], "WAIT_BUYER_PAY")
+
+        data = alipay.pay("1")
+        self.assertEqual(alipay.api_alipay_trade_query("1")["trade_status"], "TRADE_SUCCESS")
+        signature = data.pop("sign")
+        self.assertTrue(alipay.verify(data, signature))
+
+    def test_alipay_client_is_shared(self):
+        self.assertIs(get_alipay_client(), get_alipay_client())
+
+    def test_notify_with_wrong_sign(self):
+        alipay = new_alipay_client()
+        alipay.api_alipay_trade_page_pay(subject="test", out_trade_no="2", total_amount="20.00")
+        data = alipay.pay("2")
+        data["sign"] = "wrong-sign"
+        self.assertFalse(handle_notify(data))
+        del data["sign"]
+        self.assertFalse(handle_notify(data))
@@ -0,0 +1,20 @@
+from django.core.cache import cache
+from orders.models import OrderInfo
+
+# 用户订单总数的缓存
+ORDER_COUNT_KEY = "order_count_%s"
+ORDER_COUNT_TIMEOUT = 24 * 3600
+
+
+def get_order_count(user_id):
+    """获取用户的订单总数，使用缓存"""
+    count = cache.get(ORDER_COUNT_KEY % user_id)
+    if count is None:
+        count = OrderInfo.objects.filter(user_id=user_id).count()
+        cache.set(ORDER_COUNT_KEY % user_id, count, ORDER_COUNT_TIMEOUT)
+    return count
+
+
+def clear_order_count(user_id):
+    """用户的订单数目变化时，清除订单总数的缓存"""
+    cache.delete(ORDER_COUNT_KEY % user_id)
@@ -1,21 +1,27 @@
 from django.shortcuts import render, redirect
 from django.views.generic import View
-from utils.views import LoginRequiredMixin, LoginRequiredJsonMixin, TransactionAtomicMixin
+from utils.views import LoginRequiredMixin, LoginRequiredJsonMixin
 from django.core.urlresolvers import reverse
-from goods.models import GoodsSKU
-from django_redis import get_redis_connection
+from goods.utils import get_skus
 from users.models import Address
 from django.http import JsonResponse, HttpResponse
 from orders.models import OrderInfo, OrderGoods
-from django_redis import get_redis_connection
+from orders.commit import create_order, get_order_counts, OrderCommitError
+from orders import intents
+from celery_tasks.tasks import commit_order_intents
 from django.utils import timezone
 from django.db import transaction
-from django.core.paginator import Paginator
+from django.core.paginator import EmptyPage
+from django.db.models import Prefetch, Case, When, Value, TextField
+from utils.paginator import CachedCountPaginator
+from orders.utils import get_order_count
+from goods.reviews import clear_reviews_cache
+from cart.utils import RedisCart
 from django.core.cache import cache
-from alipay import AliPay
-import os
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from orders.payment import get_alipay_client, handle_notify, mark_order_paid, is_order_paid, PAID_ORDER_STATUS
 from django.conf import settings
-import time
 
 # Create your views here.
 
@@ -34,8 +40,6 @@ class PlaceOrderView(LoginRequiredMixin, View):
             # 跳转到购物车页面
             return redirect(reverse("cart:info"))
 
-        redis_conn = get_redis_connection("default")
-
         user_id = request.user.id
         # 查询地址信息、商品信息
         # 地址信息
@@ -45,42 +49,36 @@ class PlaceOrderView(LoginRequiredMixin, View):
         except Address.DoesNotExist:
             address = None
 
-        skus = []  # 用于传递给页面
         total_skus_amount = 0  # 商品总金额
         total_count = 0  # 商品总数量
         total_amount = 0  # 包含运费的总金额
         # 商品信息
+        # 一次性查询所有商品
+        skus, missing_ids = get_skus(sku_ids)
+        if missing_ids:
+            # 跳转到购物车页面
+            return redirect(reverse("cart:info"))
+
         if count is None:
             # 如果是从购物车页面跳转而来，要从购物车中获取商品数量的信息
-            cart = redis_conn.hgetall("cart_%s" % user_id)
-            for sku_id in sku_ids:
-                try:
-                    sku = GoodsSKU.objects.get(id=sku_id)
-                except GoodsSKU.DoesNotExist:
-                    # 跳转到购物车页面
-                    return redirect(reverse("cart:info"))
+            cart = RedisCart(user_id).items()
+            for sku in skus:
                 # 从购物车中获取商品数量
-                sku_count = cart.get(sku_id.encode())
+                sku_count = cart.get(str(sku.id).encode())
                 sku_count = int(sku_count)
 
                 # 计算商品的金额
                 amount = sku.price * sku_count
                 sku.amount = amount
                 sku.count = sku_count
-                skus.append(sku)
 
                 # 累计总金额和数量
                 total_skus_amount += amount
                 total_count += sku_count
         else:
             # 如果是从商品详情页面的立即购买跳转而来，则不用读取购物车的商品数量，直接使用count字段
-            for sku_id in sku_ids:   # 虽然只有一个商品 但是也是使用列表获取而来 [id]
-                try:
-                    sku = GoodsSKU.objects.get(id=sku_id)
-                except GoodsSKU.DoesNotExist:
-                    # 跳转到购物车页面
-                    return redirect(reverse("cart:info"))
-
+            for sku in skus:   # 虽然只有一个商品 但是也是使用列表获取而来 [id]
+                sku_id = sku.id
                 try:
                     count = int(count)
                 except Exception:
@@ -94,13 +92,12 @@ class PlaceOrderView(LoginRequiredMixin, View):
                 amount = sku.price * count
                 sku.amount = amount
                 sku.count = count
-                skus.append(sku)
 
                 total_skus_amount += amount
                 total_count += count
 
                 # 将这个商品放到购物车中，方便用户下单时出现问题，还能从购物车中找到信息
-                redis_conn.hset("cart_%s" % user_id, sku_id, count)
+                RedisCart(user_id).set(sku_id, count)
 
         trans_cost = 10  # 运费
         total_amount = total_skus_amount + trans_cost
@@ -119,7 +116,7 @@ class PlaceOrderView(LoginRequiredMixin, View):
         return render(request, "place_order.html", context)
 
 
-class CommitOrderView(LoginRequiredJsonMixin, TransactionAtomicMixin, View):
+class CommitOrderView(LoginRequiredJsonMixin, View):
     """提交订单"""
     def post(self, request):
         """接受订单数据， 保存订单"""
@@ -146,132 +143,87 @@ class CommitOrderView(LoginRequiredJsonMixin, TransactionAtomicMixin, View):
         sku_ids = sku_ids.split(",")
 
         # 获取购物车数据
-        redis_conn = get_redis_connection("default")
-        cart = redis_conn.hgetall("cart_%s" % user.id)
-
-        # 创建一个订单的基本信息数据 OrderInfo  订单商品表的数据会用到这个
-
-        # 自定义的订单编号格式 "20171026111111用户id"
-        order_id = timezone.now().strftime("%Y%m%d%H%M%S") + str(user.id)
-
-        # 创建事务用到的保存点
-        save_id = transaction.savepoint()
+        redis_cart = RedisCart(user.id)
+        cart = redis_cart.items()
 
         try:
-            order = OrderInfo.objects.create(
-                order_id=order_id,
-                user=user,
-                address=address,
-                total_amount=0,
-                trans_cost=10,  # 运费暂时写死
-                pay_method=pay_method
-            )
-
-            # 遍历商品sku_ids，判断商品信息合理与否的同时保存到订单的商品表
-            total_count = 0
-            total_amount = 0
-            for sku_id in sku_ids:
-                # 对一商品尝试下单三次
-                for i in range(3):
-                    try:
-                        sku = GoodsSKU.objects.get(id=sku_id)
-                    except GoodsSKU.DoesNotExist:
-                        # 回退到保存点
-                        transaction.savepoint_rollback(save_id)
-                        return JsonResponse({"code": 4, "message": "商品信息有误"})
-
-                    # 从购物车中获取用户订购的商品的数量
-                    count = cart.get(sku_id.encode())
-                    count = int(count)
-
-                    # 判断商品的库存够不够
-                    if count > sku.stock:
-                        transaction.savepoint_rollback(save_id)
-                        return JsonResponse({"code": 5, "message": "库存不足"})
-
-                    new_stock = sku.stock - count
-                    new_sales = sku.sales + count
-
-                    # 采用乐观锁的方式，更新商品的库存，销量
-                    # update会返回更新成功的数据数目
-
-                    result = GoodsSKU.objects.filter(id=sku_id, stock=sku.stock).update(stock=new_stock, sales=new_sales)
-                    # update goods_sku set stock=new_stock, sales=new_sales where id=sku_id and stock=sku.stock
-                    if result == 0 and i < 2:
-                        # 表示库存更新失败，下单失败
-                        continue
-                    elif result == 0 and i == 2:
-                        # 表示尝试了三次都失败
-                        transaction.savepoint_rollback(save_id)
-                        return JsonResponse({"code": 6, "message": "下单失败"})
-
-                    # 在订单商品表中保存商品的信息
-                    OrderGoods.objects.create(
-                        order=order,
-                        sku=sku,
-                        count=count,
-                        price=sku.price,
-                    )
-
-                    # 计算订单的总金额
-                    total_amount += (sku.price * count)
-                    # 计算订单商品的总数量
-                    total_count += count
-
-                    # 对这个商品下单成功
-                    break
-
-            # 更新订单信息表数据，处理总金额总数量
-            order.total_amount = total_amount + 10
-            order.total_count = total_count
-            order.save()
+            # 从购物车中获取用户订购的商品的数量
+            counts = get_order_counts(sku_ids, cart)
+        except OrderCommitError as e:
+            return JsonResponse({"code": e.code, "message": e.message})
+
+        if intents.is_enabled():
+            # 异步下单，先把商品从购物车中原子地取出，重复提交时购物车中已经没有这些商品，不会创建两个订单
+            counts = redis_cart.take(*sku_ids)
+            if counts is None:
+                return JsonResponse({"code": 4, "message": "商品信息有误"})
+            try:
+                # 保存订单意向后立即返回，由celery任务创建订单，前端使用ticket查询下单结果
+                ticket = intents.enqueue(user.id, address.id, pay_method, counts)
+            except Exception:
+                redis_cart.merge(counts)
+                raise
+            commit_order_intents.delay()
+            return JsonResponse({"code": 0, "message": "正在下单", "ticket": ticket})
+
+        # 在事务中保存订单的基本信息数据 OrderInfo 和订单商品表的数据
+        try:
+            create_order(user, address, pay_method, counts)
+        except OrderCommitError as e:
+            return JsonResponse({"code": e.code, "message": e.message})
         except Exception as e:
             print(e)
-            # 出现了任何异常信息，都要回滚事务
-            transaction.savepoint_rollback(save_id)
+            # 出现了任何异常信息，事务都已经回滚
             return JsonResponse({"code": 7, "message": "下单失败"})
 
-        # 提交数据的事务操作
-        transaction.savepoint_commit(save_id)
-
-        # 将处理后的购物车数据cart保存到redis中
+        # 将下单的商品从redis的购物车中删除，同时更新购物车总数
         # sku_ids =[1,2,3,4,5]
-        #
-        # redis_conn.hdel("cart_%s" % user.id, 1,2,3,4,5)
-
-        redis_conn.hdel("cart_%s" % user.id, *sku_ids)
+        redis_cart.delete(*sku_ids)
 
         # 返回给前端处理的结果， 返回json数据
         return JsonResponse({"code": 0, "message": "下单成功"})
 
 
+class CommitStatusView(LoginRequiredJsonMixin, View):
+    """查询异步下单的结果"""
+    def get(self, request):
+        ticket = request.GET.get("ticket")
+        if not ticket:
+            return JsonResponse({"code": 2, "message": "缺少下单编号"})
+
+        data = intents.get_ticket(ticket)
+        if data is None or data["user_id"] != request.user.id:
+            return JsonResponse({"code": 3, "message": "下单编号错误"})
+
+        if data["status"] == intents.STATUS_FAILED:
+            return JsonResponse({"code": data["code"], "status": data["status"], "message": data["message"]})
+
+        return JsonResponse({"code": 0, "status": data["status"], "message": "OK"})
+
+
 class UserOrdersView(LoginRequiredMixin, View):
     """用户订单"""
     def get(self, request, page):
         user = request.user
         # 查询订单,按最新的时间进行查询
-        orders = user.orderinfo_set.all().order_by("-create_time")
-        # 往每个订单中添加前端需要的信息
-        for order in orders:
-            order.status_name = OrderInfo.ORDER_STATUS[order.status]
-            order.pay_method_name = OrderInfo.PAY_METHODS[order.pay_method]
-            order.skus = []
-            order_skus = order.ordergoods_set.all()
-            for order_sku in order_skus:
-                sku = order_sku.sku
-                sku.count = order_sku.count
-                sku.amount = sku.price * sku.count
-                order.skus.append(sku)
+        # 订单商品只在取出当前页的订单时一起查询，每个订单商品使用单独的商品对象
+        orders = user.orderinfo_set.all().order_by("-create_time").prefetch_related(
+            Prefetch("ordergoods_set", queryset=OrderGoods.objects.select_related("sku")))
 
-        # 分页
-        paginator = Paginator(orders, 3)
-        # 获取页码的列表
-        pages = paginator.page_range
+        # 分页, 订单总数使用缓存，不用每次都执行count查询
+        paginator = CachedCountPaginator(orders, 3, count=get_order_count(user.id))
         # 获取总页数
         num_pages = paginator.num_pages
         # 当前页转化为数字
         page = int(page)
 
+        # 取第page页的内容 has_previous has_next number， 只查询这一页的订单 limit/offset
+        try:
+            page_orders = paginator.page(page)
+        except EmptyPage:
+            page_orders = paginator.page(1)
+            page = 1
+
         # 1.如果总页数<=5
         # 2.如果当前页是前3页
         # 3.如果当前页是后3页,
@@ -285,8 +237,17 @@ class UserOrdersView(LoginRequiredMixin, View):
         else:
             pages = range(page - 2, page + 3)
 
-        # 取第page页的内容 has_previous has_next number
-        page_orders = paginator.page(page)
+        # 往当前页的每个订单中添加前端需要的信息
+        page_orders.object_list = list(page_orders.object_list)
+        for order in page_orders.object_list:
+            order.status_name = OrderInfo.ORDER_STATUS[order.status]
+            order.pay_method_name = OrderInfo.PAY_METHODS[order.pay_method]
+            order.skus = []
+            for order_sku in order.ordergoods_set.all():
+                sku = order_sku.sku
+                sku.count = order_sku.count
+                sku.amount = sku.price * sku.count
+                order.skus.append(sku)
 
         context = {
             "orders": page_orders,
@@ -330,22 +291,29 @@ class CommentView(LoginRequiredMixin, View):
         total_count = request.POST.get("total_count")
         total_count = int(total_count)
 
+        # 评论内容 {sku_id: content}
+        comments = {}
         for i in range(1, total_count + 1):
             sku_id = request.POST.get("sku_%d" % i)
-            content = request.POST.get('content_%d' % i, '')
-            try:
-                order_goods = OrderGoods.objects.get(order=order, sku_id=sku_id)
-            except OrderGoods.DoesNotExist:
+            if not sku_id or not sku_id.isdigit():
                 continue
+            comments[int(sku_id)] = request.POST.get('content_%d' % i, '')
 
-            order_goods.comment = content
-            order_goods.save()
+        with transaction.atomic():
+            if comments:
+                # 一条update语句保存所有商品的评论
+                # update df_order_goods set comment=case sku_id when ... end where order_id=... and sku_id in (...)
+                comment = Case(*[When(sku_id=sku_id, then=Value(content)) for sku_id, content in comments.items()],
+                               output_field=TextField())
+                OrderGoods.objects.filter(order=order, sku_id__in=list(comments.keys())).update(
+                    comment=comment, update_time=timezone.now())
 
-            # 清除商品详情缓存
-            cache.delete("detail_%s" % sku_id)
+            OrderInfo.objects.filter(order_id=order.order_id).update(
+                status=OrderInfo.ORDER_STATUS_ENUM["FINISHED"], update_time=timezone.now())
 
-        order.status = OrderInfo.ORDER_STATUS_ENUM["FINISHED"]
-        order.save()
+        if comments:
+            # 一次清除所有商品评论的缓存
+            clear_reviews_cache(*comments.keys())
 
         return redirect(reverse("orders:info", kwargs={"page": 1}))
 
@@ -368,14 +336,7 @@ class PayView(LoginRequiredJsonMixin, View):
             return JsonResponse({"code": 3, "message": "订单信息错误"})
 
         # 构建alipay支付工具对象
-        alipay = AliPay(
-            appid=settings.ALIPAY_APPID,  # 沙箱模式中的appid
-            app_notify_url=None,  # 默认回调url
-            app_private_key_path=os.path.join(settings.BASE_DIR, "apps/orders/app_private_key.pem"),
-            alipay_public_key_path=os.path.join(settings.BASE_DIR, "apps/orders/alipay_public_key.pem"),  # 支付宝的公钥，验证支付宝回传消息使用，不是你自己的公钥,
-            sign_type="RSA2",  # RSA 或者 RSA2
-            debug=True  # 默认False, 沙箱模式配置为true
-        )
+        alipay = get_alipay_client()
 
         # 借助alipay对象，向支付宝发起支付请求
         # 电脑网站支付，需要跳转到https://openapi.alipaydev.com/gateway.do? + order_string
@@ -392,57 +353,56 @@ class PayView(LoginRequiredJsonMixin, View):
         return JsonResponse({"code": 0, "message": "发起支付成功", "url": alipay_url})
 
 
+class AlipayNotifyView(View):
+    """接收支付宝异步通知的支付结果"""
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        return super(AlipayNotifyView, self).dispatch(request, *args, **kwargs)
+
+    def post(self, request):
+        # 验证签名之后设置订单为支付成功
+        if handle_notify(request.POST.dict()):
+            # 返回success，支付宝不再重复通知
+            return HttpResponse("success")
+        return HttpResponse("failure")
+
+
 class CheckPayStatusView(LoginRequiredJsonMixin, View):
-    """检查支付结果"""
+    """检查支付结果，不等待，前端定时查询"""
     def get(self, request):
         order_id = request.GET.get("order_id")
 
         if not order_id:
             return JsonResponse({"code": 2, "message": "缺少订单号"})
 
-        # 获取订单信息
+        # 获取订单信息，只能查询自己的订单
         try:
             order = OrderInfo.objects.get(order_id=order_id, user=request.user,
-                                          status=OrderInfo.ORDER_STATUS_ENUM["UNPAID"],
                                           pay_method=OrderInfo.PAY_METHODS_ENUM["ALIPAY"])
         except OrderInfo.DoesNotExist:
             return JsonResponse({"code": 3, "message": "订单信息错误"})
 
-        # 构建alipay支付工具对象
-        alipay = AliPay(
-            appid=settings.ALIPAY_APPID,  # 沙箱模式中的appid
-            app_notify_url=None,  # 默认回调url
-            app_private_key_path=os.path.join(settings.BASE_DIR, "apps/orders/app_private_key.pem"),
-            alipay_public_key_path=os.path.join(settings.BASE_DIR, "apps/orders/alipay_public_key.pem"),  # 支付宝的公钥，验证支付宝回传消息使用，不是你自己的公钥,
-            sign_type="RSA2",  # RSA 或者 RSA2
-            debug=True  # 默认False, 沙箱模式配置为true
-        )
+        # 支付宝通知支付成功之后，redis中有支付成功的标记，从数据库中读取的订单状态可能还没有同步
+        if is_order_paid(order_id) or order.status in PAID_ORDER_STATUS:
+            return JsonResponse({"code": 0, "message": "支付成功"})
+
+        if order.status != OrderInfo.ORDER_STATUS_ENUM["UNPAID"]:
+            # 订单已经取消
+            return JsonResponse({"code": 4, "message": "订单已取消"})
 
-        # 借助alipay工具查询支付结果
-        while True:
+        # 没有收到支付宝的通知（如本地开发时支付宝访问不到notify_url），每个订单最多每10秒主动查询一次支付宝
+        if cache.add("pay_query_%s" % order_id, 1, 10):
+            alipay = get_alipay_client()
             response = alipay.api_alipay_trade_query(order_id)
             code = response.get("code")
             trade_status = response.get("trade_status")
             if code == "10000" and trade_status == "TRADE_SUCCESS":
-                # 表示用户支付成功
-                order.trade_id = response.get("trade_no") # 支付宝的交易标号
-                order.status = OrderInfo.ORDER_STATUS_ENUM["UNCOMMENT"]  # 设置订单状态为待评价
-                order.save()
-                return JsonResponse({"code": 0, "message": "支付成功"})
-            elif code == "40004" or (code == "10000" and trade_status == "WAIT_BUYER_PAY"):
-                # 表示支付宝订单还没创建好， 或者用户还未支付
-                time.sleep(10)
-                continue
-            else:
+                # 表示用户支付成功，订单已经取消时不能设置为支付成功
+                if mark_order_paid(order_id, response.get("trade_no")):
+                    return JsonResponse({"code": 0, "message": "支付成功"})
+                return JsonResponse({"code": 4, "message": "订单已取消，请联系客服退款"})
+            elif not (code == "40004" or (code == "10000" and trade_status == "WAIT_BUYER_PAY")):
                 return JsonResponse({"code": 4, "message": "支付失败"})
 
-
-
-
-
-
-
-
-
-
-
+        # 表示支付宝订单还没创建好， 或者用户还未支付
+        return JsonResponse({"code": 5, "message": "等待支付"})
@@ -1 +1,3 @@
-USER_HISTORY_NUM = 5  # 用户的历史记录信息总数
\ No newline at end of file
+from django.conf import settings
+
+USER_HISTORY_NUM = settings.USER_HISTORY_NUM  # 用户的历史记录信息总数
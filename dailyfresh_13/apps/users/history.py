@@ -0,0 +1,25 @@
+from django_redis import get_redis_connection
+from users import constants
+
+# 用户的浏览记录，列表中保存商品id，最近浏览的在最前面
+HISTORY_KEY = "history_%s"
+
+
+def record_history(user_id, sku_id, redis_conn=None):
+    """添加浏览记录，三条命令放在一个事务中发送，只需要一次网络往返"""
+    redis_conn = redis_conn or get_redis_connection("default")
+    key = HISTORY_KEY % user_id
+    pipe = redis_conn.pipeline()
+    # 移除已经存在的本商品浏览记录
+    pipe.lrem(key, 0, sku_id)
+    # 添加新的浏览记录
+    pipe.lpush(key, sku_id)
+    # 只保存设置的条数
+    pipe.ltrim(key, 0, constants.USER_HISTORY_NUM - 1)
+    pipe.execute()
+
+
+def get_history(user_id, redis_conn=None):
+    """获取浏览过的商品id，最近浏览的在最前面"""
+    redis_conn = redis_conn or get_redis_connection("default")
+    return [int(sku_id) for sku_id in redis_conn.lrange(HISTORY_KEY % user_id, 0, constants.USER_HISTORY_NUM - 1)]
@@ -12,9 +12,9 @@ from celery_tasks.tasks import send_active_email
 from django.contrib.auth import authenticate, login, logout
 from utils.views import LoginRequiredMixin
 from users.models import Address
-from django_redis import get_redis_connection
-from users import constants
-from goods.models import GoodsSKU
+from users.history import get_history
+from goods.utils import get_skus
+from cart.utils import RedisCart
 import json
 
 # Create your views here.
@@ -167,25 +167,9 @@ class LoginView(View):
         else:
             cart_cookie = {}
 
-        # 获取redis中的购物车数据
-        redis_conn = get_redis_connection("default")
-        cart_redis = redis_conn.hgetall("cart_%s" % user.id)
-
-        # 合并,
-        # cart_redis.update(cart_cookie)
-        # 数量求和
-        for sku_id, count in cart_cookie.items():
-            # sku_id 从cookie取出时str类型，redis中是bytes类型
-            sku_id = sku_id.encode()
-            if sku_id in cart_redis:
-                orign_count = cart_redis[sku_id]
-                count += int(orign_count)
-
-            cart_redis[sku_id] = count
-
-        # 将合并的结果保存到redis中
-        if cart_redis:
-            redis_conn.hmset("cart_%s" % user.id, cart_redis)
+        # 合并到redis中的购物车数据, 数量求和
+        if cart_cookie:
+            RedisCart(user.id).merge(cart_cookie)
 
         # 清除cookie中购物车数据
         # 先构建response
@@ -276,22 +260,11 @@ class UserInfoView(LoginRequiredMixin, View):
             address = None
 
         # 获取用户的浏览历史记录
-        # 拿到一个redis连接对象
-        redis_conn = get_redis_connection("default")
-        # 存在redis中的历史数据是哈希类型
-        # conn.lrange(“history_1”, 0, 4)
-        sku_ids = redis_conn.lrange("history_%s" % user.id, 0, constants.USER_HISTORY_NUM-1)
+        sku_ids = get_history(user.id)
 
         # 从数据库中，按照sku id查询商品的信息
-
-        # 一次性查出所有数据，顺序变了，所以不采纳
-        # select * from tbl where id in ()
-        # skus = GoodsSKU.objects.filter(id__in=sku_ids)
-
-        skus = []
-        for sku_id in sku_ids:
-            sku = GoodsSKU.objects.get(id=sku_id)
-            skus.append(sku)
+        # 一次性查出所有数据 select * from tbl where id in (), 再按照浏览记录的顺序排序
+        skus, _ = get_skus(sku_ids, use_cache=True)
 
         context = {
             # "user": user,  # 这个数据可以不用传，在的django中可以直接使用
@@ -7,17 +7,58 @@ os.environ["DJANGO_SETTINGS_MODULE"] = "dailyfresh_13.settings"
 # import django
 # django.setup()
 
-# celery -A celery_tasks.tasks worker -l info
+# SNOWFLAKE_WORKER_BASE=16 celery -A celery_tasks.tasks worker -l info
+# 同一台主机上的uwsgi实例和celery worker使用的进程编号不能重叠，见settings中订单编号的进程编号
 
 from django.core.mail import send_mail
 from django.conf import settings
 from django.template import loader
-from goods.models import GoodsCategory, IndexGoodsBanner, IndexPromotionBanner
-from goods.models import IndexCategoryGoodsBanner
+from goods.utils import get_index_context
+from goods import inventory
+from goods import popularity
+from goods import search_queue
+from goods.models import GoodsCategory
+from orders import intents
+from orders.payment import settle_unpaid_orders
+from orders import expiry
+from celery.utils.log import get_task_logger
+
+logger = get_task_logger(__name__)
 
 # 创建celery应用对象
 app = Celery("celery_tasks.tasks", broker="redis://10.211.55.5/2")
 
+# 定时任务
+# celery -A celery_tasks.tasks beat -l info
+app.conf.update(
+    CELERYBEAT_SCHEDULE={
+        "reconcile-inventory": {
+            "task": "celery_tasks.tasks.reconcile_inventory",
+            "schedule": 5.0,
+        },
+        "commit-order-intents": {
+            "task": "celery_tasks.tasks.commit_order_intents",
+            "schedule": 1.0,
+        },
+        "settle-alipay-orders": {
+            "task": "celery_tasks.tasks.settle_alipay_orders",
+            "schedule": 300.0,
+        },
+        "cancel-expired-orders": {
+            "task": "celery_tasks.tasks.cancel_expired_orders",
+            "schedule": 60.0,
+        },
+        "compact-popularity": {
+            "task": "celery_tasks.tasks.compact_popularity",
+            "schedule": 3600.0,
+        },
+        "update-search-index": {
+            "task": "celery_tasks.tasks.update_search_index",
+            "schedule": 10.0,
+        },
+    }
+)
+
 
 # 定义发送激活邮件任务
 @app.task
@@ -38,32 +79,10 @@ def send_active_email(user_name, to_email, token):
 def generate_static_index_html():
     """生成主页的静态html文件"""
     # 需要查询的数据
-    # 商品分类信息
-    categorys = GoodsCategory.objects.all()
-
-    # 首页轮播图信息, 按照index排序
-    index_goods_banners = IndexGoodsBanner.objects.all().order_by("index")
-
-    # 首页广告活动
-    promotions_banners = IndexPromotionBanner.objects.all().order_by("index")
-
-    # 分类商品展示  标题和图片
-    for category in categorys:
-        title_banners = IndexCategoryGoodsBanner.objects.filter(category=category, display_type=0).order_by("index")[:4]
-        category.title_banners = title_banners
-        image_banners = IndexCategoryGoodsBanner.objects.filter(category=category, display_type=1).order_by("index")[:4]
-        category.image_banners = image_banners
+    context = get_index_context()
 
     # 用户的购物车信息
-    cart_num = 0
-
-    # 处理模板页面
-    context = {
-        "categorys": categorys,
-        "index_banners": index_goods_banners,
-        "promotion_banners": promotions_banners,
-        "cart_num": cart_num
-    }
+    context["cart_num"] = 0
 
     # 加载模板
     template = loader.get_template("static_index.html")
@@ -75,19 +94,61 @@ def generate_static_index_html():
         f.write(html_data)
 
 
+# 定义同步预占库存的任务
+@app.task
+def reconcile_inventory():
+    """将redis中预占的库存批量同步到mysql中"""
+    if not inventory.is_enabled():
+        return 0
+    return inventory.reconcile()
 
 
+# 定义异步下单的任务
+@app.task
+def commit_order_intents():
+    """批量处理保存在redis中的订单意向，直到队列为空"""
+    requeued = intents.requeue_stale()
+    if requeued:
+        logger.warning("%d个订单意向处理超时，放回等待队列", requeued)
+    total = 0
+    while True:
+        count = intents.process_intents()
+        total += count
+        if count < settings.ORDER_COMMIT_BATCH:
+            return total
+
+
+# 定义查询待支付订单的任务
+@app.task
+def settle_alipay_orders():
+    """向支付宝查询待支付订单的交易状态，更新已经支付的订单"""
+    result = settle_unpaid_orders()
+    logger.info("settle alipay orders: checked %(checked)s, paid %(paid)s, %(seconds)ss, %(rate)s orders/s",
+                result)
+    return result
 
 
+# 定义取消超时未支付订单的任务
+@app.task
+def cancel_expired_orders():
+    """取消超时未支付的订单，恢复商品的库存"""
+    result = expiry.cancel_expired_orders()
+    logger.info("cancel expired orders: %(orders)s orders in %(batches)s batches, %(paid)s paid, "
+                "%(skipped)s skipped, lock %(lock_seconds)ss (max %(max_lock_seconds)ss), %(seconds)ss", result)
+    return result
 
 
+# 定义整理人气排行的任务
+@app.task
+def compact_popularity():
+    """衰减人气排行的分数，删除全站排行中靠后的商品"""
+    category_ids = GoodsCategory.objects.values_list("id", flat=True)
+    return popularity.compact_all(category_ids)
 
 
-
-
-
-
-
-
-
-
+# 定义批量更新搜索索引的任务
+@app.task
+def update_search_index():
+    """将修改过的商品批量更新到whoosh索引中"""
+    updated, removed = search_queue.update_dirty()
+    return {"updated": updated, "removed": removed}
@@ -52,6 +52,7 @@ INSTALLED_APPS = (
 
 MIDDLEWARE_CLASSES = (
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'utils.db_router.ReadYourWritesMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -105,6 +106,14 @@ DATABASES = {
 }
 # 读写分离路由
 DATABASE_ROUTERS = ["utils.db_router.MasterSlaveDBRouter"]
+# 从数据库的配置
+DATABASE_REPLICAS = {
+    "ALIASES": {"slave": 1},  # 从数据库的别名和权重，增加从数据库时同时添加到DATABASES中
+    "CHECK_INTERVAL": 5,  # 检查从数据库是否可用的间隔秒数
+    "DOWN_TIME": 30,  # 不可用的从数据库多少秒之后再检查
+    "MAX_LAG": None,  # 允许的最大复制延迟秒数，None表示不检查延迟
+    "STICKY_SECONDS": 5,  # 用户写过数据之后多少秒之内读主数据库
+}
 
 # 认证系统使用的用户模型
 AUTH_USER_MODEL = "users.User"
@@ -142,16 +151,29 @@ EMAIL_FROM = '天天生鲜<daily_fresh@126.com>'
 # Cache
 # http://django-redis-chs.readthedocs.io/zh_CN/latest/#cache-backend
 
+# 在django_redis前面增加进程内的LRU缓存，去掉OPTIONS中的LOCAL_CACHE即可关闭
 CACHES = {
     "default": {
-        "BACKEND": "django_redis.cache.RedisCache",
+        "BACKEND": "utils.cache_backends.TwoTierRedisCache",
         "LOCATION": "redis://10.211.55.5:6379/3",
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "LOCAL_CACHE": {
+                "MAX_ENTRIES": 1000,  # 每个进程最多缓存的数据条数
+                "TIMEOUT": 60,  # 进程内缓存的有效时间，防止丢失失效消息后一直使用旧数据
+                "KEY_PREFIXES": ["index_page_data", "detail_", "tag_version_"],  # 使用进程内缓存的键
+                "CHANNEL": "cache_invalidate",  # 广播失效消息的频道
+            },
         }
     }
 }
 
+# 缓存的页面快照数据超过这个字节数时进行压缩
+SNAPSHOT_COMPRESS_THRESHOLD = 1024
+
+# 单个商品数据的缓存时间
+SKU_CACHE_TIMEOUT = 300
+
 
 # Session
 # http://django-redis-chs.readthedocs.io/zh_CN/latest/#session-backend
@@ -188,12 +210,67 @@ HAYSTACK_CONNECTIONS = {
     }
 }
 
-#当添加、修改、删除数据时，自动生成索引
-HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.RealtimeSignalProcessor'
+#当添加、修改、删除数据时，记录需要更新索引的商品，由celery任务批量生成索引
+HAYSTACK_SIGNAL_PROCESSOR = 'goods.search_queue.QueuedSignalProcessor'
+# 更新索引时每次查询的商品数目
+SEARCH_INDEX_BATCH = 500
+
+# 商品列表页每页的商品数目
+GOODS_LIST_PAGE_SIZE = 10
+# 商品列表页是否使用redis中的排序索引，False时查询数据库，使用游标分页
+GOODS_LIST_USE_RANKINGS = True
+
+# 商品人气排行
+GOODS_HOT = {
+    "HALF_LIFE": 3 * 24 * 3600,  # 销量的半衰期秒数
+    "MAX_MEMBERS": 10000,  # 全站排行保留的商品数目
+    "MIN_SCORE": 0.01,  # 全站排行中分数低于这个值的商品被删除
+    "TRENDING_NUM": 5,  # 主页展示的人气商品数目
+}
+
+# 用户浏览记录保存的商品数目
+USER_HISTORY_NUM = 5
+
+# 提交订单遇到死锁或锁等待超时时的重试策略
+ORDER_COMMIT_RETRY = {
+    "TIMES": 3,  # 最多尝试的次数
+    "BACKOFF": 0.05,  # 第一次重试前等待的秒数，之后每次翻倍
+    "MAX_BACKOFF": 1,  # 最长等待的秒数
+}
+
+# 订单编号生成器的进程编号(0-1023)，同时运行的进程编号不能相同，生产环境(DEBUG=False)必须配置
+# 每个uwsgi实例、celery worker通过环境变量SNOWFLAKE_WORKER_BASE指定不同的起始编号，第n个进程使用BASE+n，
+# 单独运行的进程通过环境变量SNOWFLAKE_WORKER_ID直接指定
+# 在redis中占用进程编号的秒数，其他进程在使用相同的编号时生成订单编号会报错，0表示不检查
+SNOWFLAKE_WORKER_LEASE = 60
+
+# 异步下单，开启后提交订单时只保存订单意向，由celery任务批量创建订单
+ORDER_COMMIT_ASYNC = False
+# celery任务每批处理的订单意向数目
+ORDER_COMMIT_BATCH = 50
+# 订单意向处理超过这个秒数没有完成（处理的进程中途退出），放回等待队列
+ORDER_INTENT_TIMEOUT = 300
+
+# 抢购模式，开启后下单时在redis中预占库存，由celery任务批量同步到mysql
+INVENTORY_RESERVATION = False
+# 每个事务同步的商品数目
+INVENTORY_RECONCILE_BATCH = 200
+
+# 订单超过这个秒数没有支付时自动取消，恢复商品的库存和销量
+ORDER_UNPAID_TIMEOUT = 30 * 60
+# 每个事务取消的订单数目，控制锁定数据行的时间
+ORDER_EXPIRE_BATCH = 100
 
 # 支付宝的网址
 ALIPAY_URL = "https://openapi.alipaydev.com/gateway.do"
 ALIPAY_APPID = "2016081600258081"
+# 支付宝异步通知支付结果的网址
+ALIPAY_NOTIFY_URL = "http://127.0.0.1:8000/orders/alipay/notify"
+# 支付宝工具类，本地测试时可以使用 "orders.fake_alipay.FakeAliPay"
+ALIPAY_CLIENT_CLASS = "alipay.AliPay"
+# 后台查询待支付订单时每批的订单数目和同时查询的线程数
+ALIPAY_SETTLE_BATCH = 100
+ALIPAY_SETTLE_WORKERS = 8
 
 # 收集静态资源的文件夹
 STATIC_ROOT = "/Users/delron/Desktop/static"
@@ -0,0 +1,144 @@
+from django.core.cache import cache
+import math
+import random
+import time
+
+# 标签版本号在缓存中的键
+TAG_VERSION_KEY = "tag_version_%s"
+
+# 重新计算缓存数据时使用的锁
+LOCK_KEY = "lock_%s"
+
+# 各服务器之间允许的时钟误差（毫秒），在计算开始前这段时间内修改过的标签也认为是在计算过程中修改的
+CLOCK_SKEW_MS = 1000
+
+
+def _tag_keys(tags):
+    return [TAG_VERSION_KEY % tag for tag in tags]
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def get_tag_versions(tags, initial=None):
+    """获取标签的当前版本号， 返回 {tag: version}
+
+    :param initial: 标签还没有版本号时使用的初始值，默认为当前时间
+    """
+    tags = list(tags)
+    if not tags:
+        return {}
+    versions = cache.get_many(_tag_keys(tags))
+    result = {}
+    for tag in tags:
+        key = TAG_VERSION_KEY % tag
+        version = versions.get(key)
+        if version is None:
+            # 标签还没有版本号（或被淘汰了），用时间初始化，保证与之前记录的版本号都不相同
+            cache.add(key, initial if initial is not None else _now_ms(), None)
+            version = cache.get(key)
+        result[tag] = version
+    return result
+
+
+def bump_tags(*tags):
+    """标签依赖的数据发生了变化，更新标签的版本号，使依赖这些标签的缓存失效
+
+    版本号是修改的时间（毫秒），计算缓存时可以据此判断依赖的数据是否在计算过程中被修改过
+    """
+    keys = _tag_keys(set(tags))
+    if not keys:
+        return
+    now = _now_ms()
+    versions = cache.get_many(keys)
+    # 同一毫秒内多次修改时版本号也要变化
+    cache.set_many({key: max(now, versions.get(key, 0) + 1) for key in keys}, None)
+
+
+def _is_expired(data, beta):
+    """判断缓存数据是否需要重新计算
+
+    在到期之前按照概率提前刷新（XFetch算法）, 计算越耗时、越接近到期时间，提前刷新的概率越大
+    """
+    early = data["delta"] * beta * math.log(1 - random.random())
+    return time.time() - early >= data["expire_at"]
+
+
+def _compute_and_set(key, compute, get_tags, timeout, stale_timeout, encode):
+    """重新计算数据并保存到缓存中"""
+    start = time.time()
+    value = compute()
+    if value is None:
+        return None
+    tags = {}
+    if get_tags is not None:
+        # 依赖的标签要根据计算的数据才能知道，计算之后再获取版本号
+        # 版本号晚于计算开始的时间，说明计算过程中数据被修改了，计算结果可能是旧数据，不能保存在新的版本号下
+        since = int(start * 1000) - CLOCK_SKEW_MS
+        tags = get_tag_versions(get_tags(value), initial=since - 1)
+        if any(version >= since for version in tags.values()):
+            return value
+    now = time.time()
+    data = {
+        "value": encode(value) if encode is not None else value,
+        "tags": tags,
+        "delta": now - start,  # 计算数据所用的时间
+        "expire_at": now + timeout,  # 数据逻辑上的过期时间
+    }
+    # 在redis中多保存stale_timeout的时间，用于在重新计算时给其他进程返回旧数据
+    cache.set(key, data, timeout + stale_timeout)
+    return value
+
+
+def _get_cached(key, decode):
+    """读取缓存数据，返回(缓存的数据, 解码后的值), 缓存不存在或无法解码时返回(None, None)"""
+    data = cache.get(key)
+    if data is None:
+        return None, None
+    value = decode(data["value"]) if decode is not None else data["value"]
+    if value is None:
+        return None, None
+    return data, value
+
+
+def get_or_compute(key, compute, timeout, get_tags=None, beta=1.0, stale_timeout=300, lock_timeout=10,
+                   wait_timeout=3, encode=None, decode=None):
+    """防止缓存击穿的读取缓存方法
+
+    :param key: 缓存的键
+    :param compute: 缓存不存在时计算数据的函数, 返回None表示数据不存在，不保存缓存
+    :param timeout: 缓存的有效时间
+    :param get_tags: 根据计算的数据返回数据依赖的标签的函数
+    :param beta: 提前刷新的系数，越大越容易提前刷新
+    :param stale_timeout: 数据过期之后还可以作为旧数据返回的时间
+    :param lock_timeout: 重新计算数据时锁的有效时间
+    :param wait_timeout: 没有旧数据时，等待其他进程计算完成的最长时间
+    :param encode: 保存到缓存之前转换数据的函数
+    :param decode: 从缓存读取之后还原数据的函数, 返回None表示数据无法使用
+    :return: 缓存的数据
+    """
+    lock_key = LOCK_KEY % key
+    data, value = _get_cached(key, decode)
+    if data is not None:
+        if not _is_expired(data, beta) and get_tag_versions(data["tags"].keys()) == data["tags"]:
+            return value
+
+        # 数据已过期（或依赖的数据有变化），只让拿到锁的进程去重新计算，其他进程继续返回旧数据
+        if not cache.add(lock_key, 1, lock_timeout):
+            return value
+    elif not cache.add(lock_key, 1, lock_timeout):
+        # 缓存中没有数据，其他进程正在计算，等待其他进程计算完成
+        deadline = time.time() + wait_timeout
+        while time.time() < deadline:
+            time.sleep(0.05)
+            data, value = _get_cached(key, decode)
+            if data is not None:
+                return value
+        # 等待超时，自己计算数据
+        return _compute_and_set(key, compute, get_tags, timeout, stale_timeout, encode)
+
+    try:
+        return _compute_and_set(key, compute, get_tags, timeout, stale_timeout, encode)
+    finally:
+        cache.delete(lock_key)
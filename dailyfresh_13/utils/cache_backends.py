@@ -0,0 +1,183 @@
+from collections import OrderedDict
+from django_redis.cache import RedisCache
+import os
+import threading
+import time
+
+
+class LocalLRUCache(object):
+    """进程内的LRU缓存，数目有上限，每条数据有过期时间"""
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._data = OrderedDict()  # {key: (过期时间, 数据)}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] < time.time():
+                del self._data[key]
+                return None
+            # 标记为最近使用过
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time() + self.timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                # 淘汰最久没有使用的数据
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TwoTierRedisCache(RedisCache):
+    """在django_redis前面加一层进程内LRU缓存
+
+    只有键以LOCAL_CACHE["KEY_PREFIXES"]开头的数据才会保存到进程内缓存中，
+    这些数据被修改或删除时，通过redis的发布订阅通知所有进程删除自己的进程内缓存。
+    OPTIONS中没有LOCAL_CACHE配置时，与django_redis的RedisCache相同
+    """
+    def __init__(self, server, params):
+        super(TwoTierRedisCache, self).__init__(server, params)
+        local_options = params.get("OPTIONS", {}).get("LOCAL_CACHE")
+        self._local_enabled = local_options is not None
+        local_options = local_options or {}
+        self._local = LocalLRUCache(local_options.get("MAX_ENTRIES", 1000), local_options.get("TIMEOUT", 60))
+        self._local_prefixes = tuple(local_options.get("KEY_PREFIXES", ()))
+        self._channel = local_options.get("CHANNEL", "cache_invalidate")
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+
+    def _local_key(self, key, version=None):
+        """返回进程内缓存使用的键，不需要进程内缓存时返回None"""
+        if not self._local_enabled or not key.startswith(self._local_prefixes):
+            return None
+        # 启动订阅失效消息的线程
+        self._ensure_listener()
+        return str(self.make_key(key, version=version))
+
+    def _ensure_listener(self):
+        """每个进程启动一个订阅失效消息的线程（uwsgi的worker是fork出来的，需要按进程判断）"""
+        pid = os.getpid()
+        if self._listener_pid == pid:
+            return
+        with self._listener_lock:
+            if self._listener_pid == pid:
+                return
+            self._local.clear()
+            thread = threading.Thread(target=self._listen, name="cache-invalidate-listener")
+            thread.daemon = True
+            thread.start()
+            self._listener_pid = pid
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.get_client().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel)
+                for message in pubsub.listen():
+                    key = message["data"]
+                    if isinstance(key, bytes):
+                        key = key.decode()
+                    if key == "*":
+                        self._local.clear()
+                    else:
+                        self._local.delete(key)
+            except Exception:
+                # 连接断开期间可能丢失了失效消息，清空进程内缓存后重新订阅
+                self._local.clear()
+                time.sleep(1)
+
+    def _invalidate(self, local_keys):
+        """删除本进程的数据，并通知其他进程删除"""
+        local_keys = [key for key in local_keys if key is not None]
+        if not local_keys:
+            return
+        for key in local_keys:
+            self._local.delete(key)
+        client = self.client.get_client(write=True)
+        for key in local_keys:
+            client.publish(self._channel, key)
+
+    def get(self, key, default=None, version=None, **kwargs):
+        local_key = self._local_key(key, version)
+        if local_key is None:
+            return super(TwoTierRedisCache, self).get(key, default=default, version=version, **kwargs)
+
+        value = self._local.get(local_key)
+        if value is not None:
+            return value
+        value = super(TwoTierRedisCache, self).get(key, version=version, **kwargs)
+        if value is None:
+            return default
+        self._local.set(local_key, value)
+        return value
+
+    def get_many(self, keys, version=None, **kwargs):
+        result = {}
+        missing = []
+        for key in keys:
+            local_key = self._local_key(key, version)
+            value = self._local.get(local_key) if local_key is not None else None
+            if value is None:
+                missing.append(key)
+            else:
+                result[key] = value
+        if missing:
+            values = super(TwoTierRedisCache, self).get_many(missing, version=version, **kwargs)
+            for key, value in values.items():
+                local_key = self._local_key(key, version)
+                if local_key is not None:
+                    self._local.set(local_key, value)
+            result.update(values)
+        return result
+
+    def set(self, key, value, *args, **kwargs):
+        result = super(TwoTierRedisCache, self).set(key, value, *args, **kwargs)
+        self._invalidate([self._local_key(key, kwargs.get("version"))])
+        return result
+
+    def add(self, key, value, *args, **kwargs):
+        result = super(TwoTierRedisCache, self).add(key, value, *args, **kwargs)
+        if result:
+            self._invalidate([self._local_key(key, kwargs.get("version"))])
+        return result
+
+    def set_many(self, data, *args, **kwargs):
+        result = super(TwoTierRedisCache, self).set_many(data, *args, **kwargs)
+        self._invalidate([self._local_key(key, kwargs.get("version")) for key in data])
+        return result
+
+    def incr(self, key, delta=1, version=None, **kwargs):
+        result = super(TwoTierRedisCache, self).incr(key, delta=delta, version=version, **kwargs)
+        self._invalidate([self._local_key(key, version)])
+        return result
+
+    def delete(self, key, version=None, **kwargs):
+        result = super(TwoTierRedisCache, self).delete(key, version=version, **kwargs)
+        self._invalidate([self._local_key(key, version)])
+        return result
+
+    def delete_many(self, keys, version=None, **kwargs):
+        result = super(TwoTierRedisCache, self).delete_many(keys, version=version, **kwargs)
+        self._invalidate([self._local_key(key, version) for key in keys])
+        return result
+
+    def clear(self, *args, **kwargs):
+        result = super(TwoTierRedisCache, self).clear(*args, **kwargs)
+        if self._local_enabled:
+            self._local.clear()
+            self.client.get_client(write=True).publish(self._channel, "*")
+        return result
@@ -1,14 +1,120 @@
+from django.conf import settings
+from django.db import connections, DatabaseError
+import random
+import threading
+import time
+
+# 当前线程处理的请求的状态，由ReadYourWritesMiddleware设置
+_state = threading.local()
+
+# 从数据库的健康状态 {别名: (下次检查的时间, 是否可用)}
+_health = {}
+_health_lock = threading.Lock()
+
+# 请求中写过主数据库之后，会话中保存的读主数据库的截止时间
+PIN_SESSION_KEY = "_db_pin_until"
+
+
+def _config():
+    """从数据库的配置，没有配置DATABASE_REPLICAS时使用slave"""
+    config = {"ALIASES": {"slave": 1}, "CHECK_INTERVAL": 5, "DOWN_TIME": 30, "MAX_LAG": None, "STICKY_SECONDS": 5}
+    config.update(getattr(settings, "DATABASE_REPLICAS", {}))
+    return config
+
+
+def _replica_lag(cursor):
+    """查询从数据库落后主数据库的秒数，没有在复制时返回None"""
+    cursor.execute("SHOW SLAVE STATUS")
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    columns = [column[0] for column in cursor.description]
+    return row[columns.index("Seconds_Behind_Master")]
+
+
+def _check(alias, config):
+    """检查从数据库是否可用，配置了MAX_LAG时同时检查复制延迟"""
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute("SELECT 1")
+            if config["MAX_LAG"] is not None:
+                lag = _replica_lag(cursor)
+                return lag is not None and lag <= config["MAX_LAG"]
+        return True
+    except DatabaseError:
+        return False
+
+
+def is_healthy(alias):
+    """从数据库是否可用，检查结果在进程内缓存，不可用的从数据库在DOWN_TIME秒之内不再使用"""
+    config = _config()
+    now = time.time()
+    checked = _health.get(alias)
+    if checked is not None and checked[0] > now:
+        return checked[1]
+
+    with _health_lock:
+        checked = _health.get(alias)
+        if checked is not None and checked[0] > now:
+            return checked[1]
+        healthy = _check(alias, config)
+        interval = config["CHECK_INTERVAL"] if healthy else config["DOWN_TIME"]
+        _health[alias] = (now + interval, healthy)
+        return healthy
+
+
+def choose_replica():
+    """按照权重随机选择一个可用的从数据库，都不可用时返回None"""
+    replicas = [(alias, weight) for alias, weight in _config()["ALIASES"].items() if weight > 0]
+    while replicas:
+        point = random.uniform(0, sum(weight for _, weight in replicas))
+        for i, (alias, weight) in enumerate(replicas):
+            point -= weight
+            if point <= 0 or i == len(replicas) - 1:
+                break
+        if is_healthy(alias):
+            return alias
+        del replicas[i]
+    return None
+
+
 class MasterSlaveDBRouter(object):
-    """读写分离路由"""
+    """读写分离路由
+
+    读操作按照权重分配到可用的从数据库，用户写过数据之后的一段时间内读主数据库，避免读到从数据库中还没有同步的旧数据
+    """
 
     def db_for_read(self, model, **hints):
         """读数据库"""
-        return "slave"
+        if getattr(_state, "pinned", False):
+            return "default"
+        return choose_replica() or "default"
 
     def db_for_write(self, model, **hints):
         """写数据库"""
+        if getattr(_state, "in_request", False):
+            # 本次请求之后的读操作和用户之后的请求都读主数据库
+            _state.pinned = True
+            _state.wrote = True
         return "default"
 
     def allow_relation(self, obj1, obj2, **hints):
         """是否运行关联操作"""
-        return True
\ No newline at end of file
+        return True
+
+
+class ReadYourWritesMiddleware(object):
+    """用户写过数据之后的STICKY_SECONDS秒内，读操作都使用主数据库，需要放在SessionMiddleware之后"""
+
+    def process_request(self, request):
+        _state.in_request = True
+        _state.wrote = False
+        _state.pinned = request.session.get(PIN_SESSION_KEY, 0) > time.time()
+
+    def process_response(self, request, response):
+        if getattr(_state, "wrote", False) and hasattr(request, "session"):
+            request.session[PIN_SESSION_KEY] = time.time() + _config()["STICKY_SECONDS"]
+        _state.in_request = False
+        _state.wrote = False
+        _state.pinned = False
+        return response
@@ -0,0 +1,78 @@
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator, Page
+from django.db.models import Q
+
+
+class CachedCountPaginator(Paginator):
+    """使用已知数据总数的分页器，不再执行 select count(*)"""
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super(CachedCountPaginator, self).__init__(object_list, per_page, **kwargs)
+        self._known_count = count
+
+    @property
+    def count(self):
+        return self._known_count
+
+
+class KeysetPage(Page):
+    """游标分页的一页数据，next_cursor是下一页的游标"""
+    def __init__(self, object_list, number, paginator, next_cursor=None):
+        super(KeysetPage, self).__init__(object_list, number, paginator)
+        self.next_cursor = next_cursor
+
+
+class KeysetPaginator(CachedCountPaginator):
+    """按照 (排序字段, id) 的游标分页
+
+    带着上一页返回的游标查询下一页时使用 where (排序字段, id) > (游标) limit n，不使用offset，
+    越往后的页数查询越慢的问题只出现在直接跳转到某一页时
+
+    :param ordering: 排序字段，最后一个字段需要是唯一的，如 ("price", "id")、("-sales", "-id")，所有字段的方向需要相同
+    """
+    def __init__(self, object_list, per_page, count, ordering, **kwargs):
+        super(KeysetPaginator, self).__init__(object_list.order_by(*ordering), per_page, count, **kwargs)
+        self.fields = [field.lstrip("-") for field in ordering]
+        self.descending = ordering[0].startswith("-")
+
+    def _encode_cursor(self, obj):
+        return "_".join(str(getattr(obj, field)) for field in self.fields)
+
+    def _decode_cursor(self, cursor):
+        """解析游标，格式不正确时抛出ValueError"""
+        values = cursor.split("_")
+        if len(values) != len(self.fields):
+            raise ValueError("invalid cursor")
+        model = self.object_list.model
+        try:
+            return [model._meta.get_field(field).to_python(value) for field, value in zip(self.fields, values)]
+        except ValidationError:
+            raise ValueError("invalid cursor")
+
+    def _after(self, values):
+        """在游标之后的数据 (a > x) or (a = x and b > y)"""
+        lookup = "lt" if self.descending else "gt"
+        condition = Q()
+        for i, field in enumerate(self.fields):
+            q = Q(**{"%s__%s" % (field, lookup): values[i]})
+            for equal_field, value in zip(self.fields[:i], values[:i]):
+                q &= Q(**{equal_field: value})
+            condition |= q
+        return self.object_list.filter(condition)
+
+    def page(self, number, cursor=None):
+        """返回第number页，cursor是上一页返回的游标，没有游标或游标无效时使用offset查询"""
+        number = self.validate_number(number)
+        object_list = None
+        if cursor:
+            try:
+                object_list = list(self._after(self._decode_cursor(cursor))[:self.per_page])
+            except ValueError:
+                object_list = None
+        if object_list is None:
+            bottom = (number - 1) * self.per_page
+            object_list = list(self.object_list[bottom:bottom + self.per_page])
+
+        next_cursor = None
+        if number < self.num_pages and object_list:
+            next_cursor = self._encode_cursor(object_list[-1])
+        return KeysetPage(object_list, number, self, next_cursor)
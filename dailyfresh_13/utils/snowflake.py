@@ -0,0 +1,181 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django_redis import get_redis_connection
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+
+# 订单编号生成器（Snowflake算法），生成id时不需要访问数据库
+# 64位整数 = 41位毫秒时间戳 | 10位进程编号 | 12位同一毫秒内的序号，按照时间递增
+# 同时运行的进程编号必须不同，否则同一毫秒内会生成相同的id，进程编号来自配置，见worker_id_from_config
+
+# 时间戳的起点 2018-01-01 00:00:00 UTC, 毫秒
+EPOCH = 1514764800000
+
+WORKER_ID_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_ID_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# 环境变量中直接指定的进程编号，用于单独运行的进程
+WORKER_ID_ENV = "SNOWFLAKE_WORKER_ID"
+# 环境变量中指定的一组进程（一个uwsgi实例、一个celery worker）的起始编号，每组进程配置不同的值
+WORKER_BASE_ENV = "SNOWFLAKE_WORKER_BASE"
+
+# 进程编号在redis中的占用记录，值是占用的进程
+LEASE_KEY = "snowflake_worker_%s"
+
+
+def _process_index():
+    """uwsgi的worker编号（从1开始），或者celery子进程的编号，都不是时返回None"""
+    try:
+        import uwsgi
+    except ImportError:
+        pass
+    else:
+        return uwsgi.worker_id()
+    try:
+        from billiard.process import current_process
+    except ImportError:
+        return None
+    return getattr(current_process(), "index", None)
+
+
+def worker_id_from_config():
+    """从配置中获取当前进程的编号，没有配置时返回None
+
+    环境变量SNOWFLAKE_WORKER_ID直接指定进程编号，
+    否则使用环境变量SNOWFLAKE_WORKER_BASE加上uwsgi或celery中的进程序号，
+    同一台主机上的多个uwsgi实例、celery worker的SNOWFLAKE_WORKER_BASE之间要相差超过进程数
+    """
+    if os.environ.get(WORKER_ID_ENV):
+        return int(os.environ[WORKER_ID_ENV])
+    if not os.environ.get(WORKER_BASE_ENV):
+        return None
+    index = _process_index()
+    return None if index is None else int(os.environ[WORKER_BASE_ENV]) + index
+
+
+def current_worker_id():
+    """当前进程的编号，没有配置时只有开发环境（DEBUG=True）根据进程id计算
+
+    主机名的哈希与进程id异或之后取低10位，进程id对1024同余的进程会得到相同的编号，不能保证不重复
+    """
+    worker_id = worker_id_from_config()
+    if worker_id is not None:
+        return worker_id
+    if not settings.DEBUG:
+        raise ImproperlyConfigured("无法确定订单编号生成器的进程编号，请配置环境变量%s或%s"
+                                   % (WORKER_BASE_ENV, WORKER_ID_ENV))
+    return (zlib.crc32(socket.gethostname().encode()) ^ os.getpid()) & MAX_WORKER_ID
+
+
+class RedisWorkerLease(object):
+    """在redis中占用进程编号，发现其他进程（包括其他主机上的进程）在使用相同的编号时报错
+
+    占用的记录在SNOWFLAKE_WORKER_LEASE秒之后过期，生成id时定期续期，进程退出之后编号可以被其他进程使用
+    """
+    def __init__(self, redis_conn=None, timeout=None):
+        self._redis_conn = redis_conn
+        self._timeout = timeout
+
+    def claim(self, worker_id, owner):
+        """占用或续期进程编号，返回下次续期前的秒数，不检查时返回None"""
+        timeout = self._timeout if self._timeout is not None else settings.SNOWFLAKE_WORKER_LEASE
+        if not timeout:
+            return None
+        redis_conn = self._redis_conn or get_redis_connection("default")
+        key = LEASE_KEY % worker_id
+        if not redis_conn.set(key, owner, nx=True, ex=timeout):
+            holder = redis_conn.get(key)
+            # 自己占用的编号续期，刚好过期时重新占用
+            if holder is None or holder.decode() != owner or not redis_conn.expire(key, timeout):
+                if not redis_conn.set(key, owner, nx=True, ex=timeout):
+                    raise ImproperlyConfigured("进程编号%d正在被其他进程使用: %s" % (
+                        worker_id, holder.decode() if holder is not None else ""))
+        return timeout / 3.0
+
+
+def _check_range(worker_id):
+    if not 0 <= worker_id <= MAX_WORKER_ID:
+        raise ValueError("worker_id必须在0到%d之间" % MAX_WORKER_ID)
+
+
+class SnowflakeIdGenerator(object):
+    """生成时间有序、不重复的id
+
+    :param worker_id: 进程编号，默认从配置中获取
+    :param lease: 占用进程编号的对象（如RedisWorkerLease），为None时不检查其他进程是否在使用相同的编号
+    """
+    def __init__(self, worker_id=None, lease=None):
+        if worker_id is not None:
+            _check_range(worker_id)
+        self._fixed_worker_id = worker_id
+        self._lease = lease
+        self._lock = threading.Lock()
+        self._pid = None
+        self._worker_id = None
+        self._owner = None
+        self._renew_at = None
+        self._last_timestamp = -1
+        self._sequence = 0
+
+    @staticmethod
+    def _now():
+        return int(time.time() * 1000)
+
+    def _claim(self):
+        if self._lease is None:
+            return
+        interval = self._lease.claim(self._worker_id, self._owner)
+        self._renew_at = time.time() + interval if interval is not None else None
+
+    def next_id(self):
+        """返回一个新的id（整数）"""
+        with self._lock:
+            pid = os.getpid()
+            if pid != self._pid:
+                # 第一次使用，或者是fork出来的子进程（如uwsgi的worker），重新获取进程编号
+                worker_id = self._fixed_worker_id
+                if worker_id is None:
+                    worker_id = current_worker_id()
+                    _check_range(worker_id)
+                self._worker_id = worker_id
+                self._owner = "%s:%d:%s" % (socket.gethostname(), pid, uuid.uuid4().hex[:8])
+                self._claim()
+                self._pid = pid
+                self._last_timestamp = -1
+                self._sequence = 0
+            elif self._renew_at is not None and time.time() >= self._renew_at:
+                self._claim()
+
+            timestamp = self._now()
+            if timestamp < self._last_timestamp:
+                # 系统时间被调回了，等待时间追上上一次生成id的时间
+                time.sleep((self._last_timestamp - timestamp) / 1000.0)
+                timestamp = max(self._now(), self._last_timestamp)
+
+            if timestamp == self._last_timestamp:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # 这一毫秒的序号用完了，等到下一毫秒
+                    while timestamp <= self._last_timestamp:
+                        timestamp = self._now()
+            else:
+                self._sequence = 0
+
+            self._last_timestamp = timestamp
+            return ((timestamp - EPOCH) << (WORKER_ID_BITS + SEQUENCE_BITS)) | \
+                   (self._worker_id << SEQUENCE_BITS) | self._sequence
+
+
+# 进程内共用的生成器，第一次生成id时才获取进程编号
+_generator = SnowflakeIdGenerator(lease=RedisWorkerLease())
+
+
+def next_order_id():
+    """生成订单编号，固定19位数字，字符串的顺序与时间顺序相同"""
+    return "%019d" % _generator.next_id()